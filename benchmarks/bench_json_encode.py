@@ -0,0 +1,79 @@
+"""
+Compares dojango.util.json_encode with the former implementation that built
+a copy of the data before passing it to json.dumps (see legacy.py).
+
+Each variant runs in a fresh python process, that encodes a dojo.data
+structure (as returned by to_dojo_data) of a list of model instances or, for
+the "-queryset" variants, of a QuerySet (including the database query). The
+time of the fastest run and the growth of the peak memory while encoding are
+reported as json, the outputs of all variants are checked to be identical.
+
+Usage:
+    python bench_json_encode.py [rows] [repeat]
+"""
+import gc
+import hashlib
+import json
+import subprocess
+import sys
+import time
+
+import bootstrap
+
+VARIANTS = ('legacy', 'dojango', 'legacy-queryset', 'dojango-queryset')
+
+def run_variant(variant, rows, repeat):
+    bootstrap.setup()
+    import fixtures
+    from benchapp.models import Flat
+    from dojango.util import to_dojo_data
+    if variant.startswith('legacy'):
+        from legacy import json_encode
+    else:
+        from dojango.util import json_encode
+
+    fixtures.create_flat(rows)
+    if variant.endswith('-queryset'):
+        make_data = lambda: to_dojo_data(Flat.objects.all(), num_rows=rows)
+    else:
+        objects = list(Flat.objects.all())
+        make_data = lambda: to_dojo_data(objects, num_rows=rows)
+    json_encode(Flat.objects.all()[:1]) # warm up the caches
+    gc.collect()
+
+    rss_before = bootstrap.max_rss()
+    timings = []
+    for i in range(repeat):
+        data = make_data()
+        start = time.time()
+        output = json_encode(data)
+        timings.append(time.time() - start)
+        if i == 0:
+            peak_growth = bootstrap.max_rss() - rss_before
+        del output, data
+    output = json_encode(make_data())
+    return {
+        'variant': variant,
+        'rows': rows,
+        'seconds': min(timings),
+        'peak_memory_growth': peak_growth,
+        'output_md5': hashlib.md5(output).hexdigest(),
+    }
+
+def main(rows=10000, repeat=5):
+    results = []
+    for variant in VARIANTS:
+        child = subprocess.Popen([sys.executable, __file__, '--variant', variant, str(rows), str(repeat)],
+                                 stdout=subprocess.PIPE)
+        out, err = child.communicate()
+        if child.returncode:
+            raise SystemExit('Running the variant %s failed' % variant)
+        results.append(json.loads(out))
+    identical = len(set([r['output_md5'] for r in results])) == 1
+    print json.dumps({'results': results, 'identical_output': identical}, indent=2)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--variant':
+        print json.dumps(run_variant(sys.argv[2], int(sys.argv[3]), int(sys.argv[4])))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,23 @@
+"""
+The django-piston handlers of the benchmark models (just imported, if piston
+is installed).
+"""
+from piston.handler import BaseHandler
+
+from benchapp.models import Flat, Book, Article, Node
+
+class FlatHandler(BaseHandler):
+    model = Flat
+    fields = ('id', 'name', 'description', 'amount', 'quantity', 'ratio', 'active', 'created', 'day')
+
+class BookHandler(BaseHandler):
+    model = Book
+    fields = ('id', 'title', 'price', 'published', ('author', ('id', 'name')), ('category', ('id', 'name')))
+
+class ArticleHandler(BaseHandler):
+    model = Article
+    fields = ('id', 'title', 'body', ('tags', ('id', 'name')))
+
+class NodeHandler(BaseHandler):
+    model = Node
+    fields = ('id', 'name', 'parent_id')
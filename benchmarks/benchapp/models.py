@@ -0,0 +1,87 @@
+from django.db import models
+
+class Flat(models.Model):
+    """A model with the common field types and no relations."""
+    name = models.CharField(max_length=100)
+    description = models.TextField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField()
+    ratio = models.FloatField()
+    active = models.BooleanField(default=True)
+    created = models.DateTimeField()
+    day = models.DateField()
+    attachment = models.FileField(upload_to='bench', blank=True)
+
+    def __unicode__(self):
+        return self.name
+
+class Author(models.Model):
+    name = models.CharField(max_length=100)
+
+    def __unicode__(self):
+        return self.name
+
+class Publisher(models.Model):
+    name = models.CharField(max_length=100)
+    city = models.CharField(max_length=100)
+
+    def __unicode__(self):
+        return self.name
+
+class Category(models.Model):
+    name = models.CharField(max_length=100)
+
+    def __unicode__(self):
+        return self.name
+
+class Book(models.Model):
+    """A model with several foreign keys."""
+    title = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    published = models.DateTimeField()
+    author = models.ForeignKey(Author)
+    publisher = models.ForeignKey(Publisher)
+    category = models.ForeignKey(Category)
+
+    def __unicode__(self):
+        return self.title
+
+    # used as "inclusions" of the datagrid_list view
+    def author_name(self):
+        return self.author.name
+    author_name.depends_on = ('author__name',)
+
+    def publisher_name(self):
+        return self.publisher.name
+    publisher_name.depends_on = ('publisher__name',)
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100)
+
+    def __unicode__(self):
+        return self.name
+
+class Article(models.Model):
+    """A model with a many-to-many relation."""
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+    tags = models.ManyToManyField(Tag)
+
+    def __unicode__(self):
+        return self.title
+
+    # used as "inclusion" of the datagrid_list view
+    def tag_names(self):
+        return u', '.join(sorted(tag.name for tag in self.tags.all()))
+    tag_names.depends_on = ('tags__name',)
+
+class Node(models.Model):
+    """A tree model, that can be used with the TreeStore."""
+    name = models.CharField(max_length=100)
+    parent = models.ForeignKey('self', null=True, related_name='children')
+
+    def __unicode__(self):
+        return self.name
+
+    def get_children(self):
+        return self.children.all()
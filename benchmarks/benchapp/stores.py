@@ -0,0 +1,47 @@
+"""
+The modelstore Stores of the benchmark models. The ModelQueryStores reuse
+the fields of the corresponding Store.
+"""
+from dojango.data.modelstore import Store, ModelQueryStore, StoreField, ReferenceField, ValueMethod
+from dojango.data.modelstore.fields import DojoDateField
+from dojango.data.modelstore.treestore import TreeStore
+
+class FlatStore(Store):
+    name = StoreField()
+    description = StoreField()
+    amount = StoreField(get_value=ValueMethod('to_eng_string'))
+    quantity = StoreField()
+    ratio = StoreField()
+    active = StoreField()
+    created = DojoDateField()
+    day = StoreField(get_value=ValueMethod('isoformat'))
+
+class FlatQueryStore(ModelQueryStore, FlatStore):
+    pass
+
+class BookStore(Store):
+    title = StoreField()
+    price = StoreField(get_value=ValueMethod('to_eng_string'))
+    published = DojoDateField()
+    author = ReferenceField()
+    author_name = StoreField('author.name')
+    publisher_city = StoreField('publisher.city')
+    category = StoreField('category.name')
+
+class BookQueryStore(ModelQueryStore, BookStore):
+    pass
+
+class ArticleStore(Store):
+    title = StoreField()
+    body = StoreField()
+    tags = ReferenceField()
+
+class ArticleQueryStore(ModelQueryStore, ArticleStore):
+    pass
+
+class NodeStore(TreeStore):
+    name = StoreField()
+
+class NodeQueryStore(ModelQueryStore):
+    name = StoreField()
+    parent = ReferenceField()
@@ -0,0 +1,820 @@
+"""
+Tests of dojango's data paths on the models of the benchmarks. Run them with:
+
+    cd benchmarks
+    PYTHONPATH=..:. DJANGO_SETTINGS_MODULE=settings django-admin.py test benchapp
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, Http404
+from django.db import connection, reset_queries
+from django.db.models.query import EmptyQuerySet
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils.translation import ugettext_lazy
+
+from dojango.conf import settings as dojango_settings
+from dojango.decorators import json_response, json_stream_response, json_response_etag, \
+    cached_json_response, coalesce_requests
+from dojango.data.modelstore import Store, ModelQueryStore, StoreField, ReferenceField, ValueMethod, ObjectMethod, \
+    StoreMethod, ObjectArg, RequestArg
+from dojango.data.modelstore.fields import DojoDateField
+from dojango.data.modelstore.stores import compile_pattern
+from dojango.util import json_backend, paging, json_encode, json_encode_iter, to_dojo_data, \
+    to_json_response, not_modified_response
+from dojango.util import register_encoder, _model_plans, _encoders, _encoder_cache
+from dojango.util.paging import paginate, get_count
+from dojango.util.search import IndexSearchBackend, get_search_backend
+
+from dojango.views import datagrid_list, datagrid_export, datagrid_aggregates
+
+import fixtures
+import legacy
+from benchapp.models import Flat, Author, Publisher, Category, Book, Article
+
+class JsonEncodeTest(TestCase):
+
+    def setUp(self):
+        fixtures.create_fk(20)
+        fixtures.create_flat(10)
+
+    def assertEncoded(self, data):
+        self.assertEqual(json_encode(data), legacy.json_encode(data))
+
+    def test_models(self):
+        self.assertEncoded(list(Flat.objects.all()))
+        books = list(Book.objects.select_related('author'))
+        self.assertEncoded(books)
+        self.assertTrue(Book in _model_plans)
+        # properties that were added to an instance are encoded as well
+        books[0].rank = 1
+        books[1].author_name = books[1].author.name
+        self.assertEncoded(books[:3])
+
+    def test_querysets(self):
+        for queryset in (Flat.objects.all(), Flat.objects.order_by('-amount')[2:5],
+                         Book.objects.select_related('author'), Book.objects.prefetch_related('author')):
+            expected = legacy.json_encode(queryset.all())
+            with self.assertNumQueries(len(getattr(queryset, '_prefetch_related_lookups', ())) + 1):
+                self.assertEqual(json_encode(queryset), expected)
+        # the plain rows are written out of values_list(), without evaluating the QuerySet
+        queryset = Flat.objects.all()
+        json_encode(queryset)
+        self.assertEqual(queryset._result_cache, None)
+
+    def test_values(self):
+        # the json is written directly, without building a copy of the data first
+        self.assertEncoded({
+            'text': u'\xe4 "quoted" </script>', 'bytes': 'abc', 'lazy': ugettext_lazy(u'Label'),
+            'numbers': [0, -1, 10 ** 20, 0.1, 1e-7, Decimal('3.14'), True, False, None],
+            'dates': [fixtures.BASE_DATE, fixtures.BASE_DATE.date(), datetime.time(12, 30)],
+            'nested': {1: [[], {}], 'a': ({'b': [u'c']},)},
+        })
+        self.assertEncoded([float('inf'), float('-inf')])
+
+    def test_stream(self):
+        def books(request):
+            return to_dojo_data(Book.objects.order_by('-id'), num_rows=20)
+        request = RequestFactory().get('/')
+        expected = json_response(books)(request).content
+        response = json_stream_response(books)(request)
+        self.assertTrue(response.streaming)
+        # the rows are fetched while the response is sent
+        with self.assertNumQueries(1):
+            self.assertEqual(''.join(response.streaming_content), expected)
+        data = {'books': Book.objects.select_related('author'), 'flat': list(Flat.objects.all())}
+        self.assertEqual(''.join(json_encode_iter(data)), json_encode(data))
+
+    def test_register_encoder(self):
+        class Money(object):
+            def __init__(self, amount, author):
+                self.amount, self.author = amount, author
+        class Euro(Money):
+            pass
+        author = Author.objects.all()[0]
+        register_encoder(Money, lambda m: {'amount': m.amount, 'author': m.author})
+        try:
+            # subclasses use the encoder of their base class, the returned value is encoded again
+            self.assertEqual(json_encode([Euro(Decimal('1.50'), author)]),
+                             '[{"amount": "1.50", "author": %s}]' % json_encode(author))
+            register_encoder(Euro, lambda m: str(m.amount))
+            self.assertEqual(json_encode([Money(1, None), Euro(2, None)]),
+                             '[{"amount": 1, "author": null}, "2"]')
+        finally:
+            del _encoders[Money], _encoders[Euro]
+            _encoder_cache.clear()
+        # other types are left to json.dumps
+        self.assertEqual(json_encode((1, u'\xe4')), '[1, "\\u00e4"]')
+
+    def test_memoize(self):
+        class Money(object):
+            pass
+        calls = []
+        register_encoder(Money, lambda m: calls.append(m) or 1)
+        try:
+            prices = [Money()]
+            books = list(Book.objects.select_related('author'))
+            data = {'books': books, 'prices': [prices, prices, prices]}
+            self.assertEqual(json_encode(data, memoize=True), json_encode(data))
+            self.assertEqual(len(calls), 4)
+        finally:
+            del _encoders[Money]
+            _encoder_cache.clear()
+
+    def test_circular_reference(self):
+        data = {'items': []}
+        data['items'].append(data)
+        for options in ({'memoize': True}, {'max_depth': 10}):
+            self.assertRaises(ValueError, json_encode, data, **options)
+        # the same object twice is not a circular reference
+        items = [1]
+        self.assertEqual(json_encode([items, items], memoize=True), '[[1], [1]]')
+
+    def test_max_depth(self):
+        author = Author.objects.order_by('id')[0]
+        data = [[author], {'a': {'b': 1}, 'c': []}]
+        self.assertEqual(json_encode(data, max_depth=2),
+                         '[[{"_reference": %s}], {"a": null, "c": null}]' % author.pk)
+        book = Book.objects.select_related('author').order_by('id')[0]
+        self.assertEqual(json.loads(json_encode(book, max_depth=1))['_author_cache'], {'_reference': book.author_id})
+        self.assertEqual(json_encode(Book.objects.order_by('id')[:2], max_depth=1),
+                         '[{"_reference": 1}, {"_reference": 2}]')
+        self.assertEqual(json_encode(data, max_depth=10), json_encode(data))
+
+class JsonBackendTest(TestCase):
+
+    def test_get_backend(self):
+        self.assertEqual(json_backend.get_backend('json'), (json.dumps, json.loads))
+        data = {'text': u'\xe4', 'list': [1, 2.5, None, True]}
+        # the backends that aren't installed fall back to the json module
+        for name in ('auto',) + json_backend.FASTEST_BACKENDS:
+            dumps, loads = json_backend.get_backend(name)
+            self.assertEqual(loads(dumps(data)), data)
+        self.assertRaises(ImproperlyConfigured, json_backend.get_backend, 'yaml')
+
+    def test_fallback(self):
+        def missing():
+            raise ImportError("No module named missing")
+        json_backend.BACKENDS['missing'] = missing
+        try:
+            self.assertEqual(json_backend.get_backend('missing'), (json.dumps, json.loads))
+        finally:
+            del json_backend.BACKENDS['missing']
+
+class EtagTest(TestCase):
+
+    def get(self, etag=None):
+        if etag is None:
+            return RequestFactory().get('/')
+        return RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag)
+
+    def test_body_etag(self):
+        data = {'items': [1, 2]}
+        self.assertFalse(to_json_response(data).has_header('ETag'))
+        response = to_json_response(data, request=self.get(), etag=True)
+        tag = response['ETag']
+        self.assertEqual(response['Cache-Control'], dojango_settings.JSON_CACHE_CONTROL)
+        for etag in (tag, '"other", %s' % tag, '*'):
+            response = to_json_response(data, request=self.get(etag), etag=True)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], tag)
+        self.assertEqual(to_json_response({'items': [1]}, request=self.get(tag), etag=True).status_code, 200)
+        # just GET and HEAD requests are conditional
+        post = RequestFactory().post('/', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(to_json_response(data, request=post, etag=True).status_code, 200)
+
+    def test_version_etag(self):
+        calls = []
+        @json_response_etag(version=lambda request: 7)
+        def view(request):
+            calls.append(request)
+            return {'a': 1}
+        tag = view(self.get())['ETag']
+        self.assertTrue(tag.startswith('W/'))
+        # the view isn't called, if the client has the version
+        self.assertEqual(view(self.get(tag)).status_code, 304)
+        self.assertEqual(view(self.get(tag[2:])).status_code, 304)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(not_modified_response(self.get(tag), 7)['ETag'], tag)
+        self.assertEqual(not_modified_response(self.get(tag), 8), None)
+        self.assertEqual(not_modified_response(self.get(), 7), None)
+
+class StoreTest(TestCase):
+
+    def setUp(self):
+        fixtures.create_flat(30)
+
+    def test_meta_objects_are_not_evaluated(self):
+        class FlatNameStore(Store):
+            name = StoreField()
+            class Meta:
+                objects = Flat.objects.all()
+        store = FlatNameStore()
+        self.assertEqual(len(store.to_python()['items']), 30)
+        # every call (and thread) iterates its own clone of the QuerySet
+        self.assertEqual(FlatNameStore.Meta.objects._result_cache, None)
+        Flat.objects.filter(quantity__gte=10).delete()
+        self.assertEqual(len(store.to_python()['items']), 10)
+
+    def test_method_without_base_init(self):
+        class UpperMethod(ObjectMethod):
+            # doesn't call ObjectMethod.__init__
+            def __init__(self, method_or_methodname):
+                self.method_or_methodname = method_or_methodname
+                self.args, self.kwargs, self.field = (), {}, None
+            def get_value(self):
+                return super(UpperMethod, self).get_value().upper()
+        class FlatNameStore(Store):
+            name = StoreField(get_value=UpperMethod('__unicode__'))
+            class Meta:
+                objects = Flat.objects.order_by('id')[:2]
+        self.assertEqual([item['name'] for item in FlatNameStore().to_python()['items']],
+                         [unicode(flat).upper() for flat in Flat.objects.order_by('id')[:2]])
+
+    def test_compiled_plan(self):
+        class UpperField(StoreField):
+            def get_value(self):
+                return self.proxied_args['ObjectArg'].name.upper()
+        class FlatPlanStore(Store):
+            name = StoreField()
+            day = StoreField(get_value=ValueMethod('strftime', '%d.%m.%Y'))
+            text = StoreField(get_value=ObjectMethod('__unicode__'))
+            row = StoreField(get_value=StoreMethod('format_row', ObjectArg, RequestArg, 'quantity'))
+            upper = UpperField()
+            class Meta:
+                objects = Flat.objects.order_by('id')[:3]
+            def format_row(self, obj, request, name):
+                return '%s %s %s' % (obj.pk, request.GET['q'], getattr(obj, name))
+        plan = dict((name, accessor) for name, field, accessor in FlatPlanStore._serialization_plan)
+        # fields that override get_value() aren't compiled
+        self.assertEqual(plan['upper'], None)
+        self.assertTrue(plan['name'] and plan['day'] and plan['text'] and plan['row'])
+        expected = [{'id': 'benchapp.flat__%s' % flat.pk, 'name': flat.name, 'day': flat.day.strftime('%d.%m.%Y'),
+                     'text': unicode(flat), 'label': unicode(flat), 'row': '%s x %s' % (flat.pk, flat.quantity),
+                     'upper': flat.name.upper()}
+                    for flat in Flat.objects.order_by('id')[:3]]
+        data = json.loads(FlatPlanStore()(RequestFactory().get('/', {'q': 'x'})))
+        # the placeholder args are substituted for every object, not just the first one
+        self.assertEqual(data['items'], expected)
+        class HookStore(FlatPlanStore):
+            def _handle_field(self, obj, field):
+                super(HookStore, self)._handle_field(obj, field)
+        self.assertEqual(json.loads(HookStore()(RequestFactory().get('/', {'q': 'x'})))['items'], expected)
+
+class BookStore(Store):
+    title = StoreField()
+    author = ReferenceField()
+    author_name = StoreField('author.name')
+
+class UnoptimizedBookStore(BookStore):
+    class Meta:
+        prefetch = False
+
+class PrefetchTest(TestCase):
+
+    def setUp(self):
+        fixtures.create_fk(20)
+
+    def assertItems(self, objects, queries):
+        expected = UnoptimizedBookStore(objects=objects.all()).to_python()['items']
+        store = BookStore(objects=objects)
+        self.assertNumQueries(queries, store.to_python)
+        self.assertEqual(store.to_python()['items'], expected)
+
+    def test_select_related(self):
+        self.assertItems(Book.objects.all(), 1)
+
+    def test_only(self):
+        # the deferred ForeignKey isn't followed by select_related
+        self.assertItems(Book.objects.only('title'), 1 + 2 * 20)
+        self.assertItems(Book.objects.only('title', 'author'), 1)
+
+    def test_defer(self):
+        self.assertItems(Book.objects.defer('author'), 1 + 2 * 20)
+        self.assertItems(Book.objects.defer('price'), 1)
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in (u'Betamax', u'Alpha', u'Beta', u'Beta Beta'):
+            Author.objects.create(name=name)
+        self.backend = IndexSearchBackend(Author, ('name',), path=os.path.join(self.tmp_dir, 'index'))
+        self.backend.build()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_filter_is_ranked(self):
+        # the exact matches first, the primary key decides between equal ranks
+        names = [a.name for a in self.backend.filter(Author.objects.all(), 'beta')]
+        self.assertEqual(names, [u'Beta', u'Beta Beta', u'Betamax'])
+        self.assertEqual(list(self.backend.filter(Author.objects.all(), 'gamma')), [])
+
+    def test_reload(self):
+        self.assertEqual(self.backend.search('gamma'), [])
+        index = self.backend._index
+        gamma = Author.objects.create(name=u'Gamma')
+        self.backend.build()
+        # (the file may be rewritten within the resolution of its mtime)
+        os.utime(self.backend.path, (0, 0))
+        self.assertEqual(self.backend.search('gamma'), [gamma.pk])
+        # the index that other threads may still use isn't changed
+        self.assertEqual(index[1].get(u'gamma'), None)
+
+    def test_changed_setting(self):
+        def config(name):
+            return {'benchapp.author': {'fields': ('name',), 'path': os.path.join(self.tmp_dir, name)}}
+        with override_settings(DOJANGO_DATAGRID_SEARCH=config('a')):
+            backend = get_search_backend(Author)
+            self.assertEqual(backend.path, os.path.join(self.tmp_dir, 'a'))
+            self.assertTrue(get_search_backend(Author) is backend)
+        with override_settings(DOJANGO_DATAGRID_SEARCH=config('b')):
+            self.assertEqual(get_search_backend(Author).path, os.path.join(self.tmp_dir, 'b'))
+        self.assertEqual(get_search_backend(Author), None)
+
+    def test_missing_postings(self):
+        # the words and postings of an index don't have to match up
+        mtime = self.backend._load()[0]
+        self.backend._index = (mtime, {}, [u'beta'])
+        self.assertEqual(self.backend.search('bet'), [])
+
+class FlatQueryStore(ModelQueryStore):
+    name = StoreField()
+    quantity = StoreField()
+    active = StoreField()
+    created = DojoDateField()
+    day = StoreField(get_value=ValueMethod('isoformat'))
+
+    class Meta:
+        objects = Flat.objects.order_by('pk')
+        objects_per_query = 100
+        filter_fields = ('name', 'created')
+
+class ModelQueryStoreTest(TestCase):
+
+    def setUp(self):
+        for i, name in enumerate([u'a*b', u'axb', u'a?b', u'50%', u'500', u'a_b', u'A_B', u'Item']):
+            Flat.objects.create(name=name, description=u'', amount='1.00', quantity=i % 3, ratio=0.5,
+                                active=True, created=fixtures.BASE_DATE, day=fixtures.BASE_DATE.date())
+        self.store = FlatQueryStore()
+        self.factory = RequestFactory()
+
+    def names(self, **params):
+        data = self.store(self.factory.get('/', params))
+        self.assertEqual(data['numRows'], len(data['items']))
+        return [item['name'] for item in data['items']]
+
+    def test_compile_pattern(self):
+        self.assertEqual(compile_pattern(u'a\\*b'), ('exact', u'a*b'))
+        self.assertEqual(compile_pattern(u'a\\?b*'), ('startswith', u'a?b'))
+        self.assertEqual(compile_pattern(u'a*b'), ('regex', u'^a.*b$'))
+        self.assertEqual(compile_pattern(u'a?b', True), ('iregex', u'^a.b$'))
+        self.assertEqual(compile_pattern(u'**'), None)
+
+    def test_escaped_wildcards(self):
+        self.assertEqual(self.names(name=u'a\\*b'), [u'a*b'])
+        self.assertEqual(self.names(name=u'a\\?b'), [u'a?b'])
+        self.assertEqual(self.names(name=u'a?b'), [u'a*b', u'axb', u'a?b', u'a_b'])
+        self.assertEqual(self.names(name=u'*'), [f.name for f in Flat.objects.order_by('pk')])
+
+    def test_literal_like_characters(self):
+        # % and _ aren't wildcards of a Dojo query
+        self.assertEqual(self.names(name=u'50%*'), [u'50%'])
+        self.assertEqual(self.names(name=u'*%'), [u'50%'])
+        # (LIKE ignores the case on some databases)
+        self.assertEqual(self.names(name=u'*_b', queryOptions='{"ignoreCase": true}'), [u'a_b', u'A_B'])
+        self.assertEqual(self.names(name=u'a_?'), [u'a_b'])
+        self.assertEqual(self.names(name=u'a_b'), [u'a_b'])
+
+    def test_ignore_case(self):
+        self.assertEqual(self.names(name=u'a_b'), [u'a_b'])
+        self.assertEqual(self.names(name=u'a_b', queryOptions='{"ignoreCase": true}'), [u'a_b', u'A_B'])
+        self.assertEqual(self.names(name=u'a?B', queryOptions='{"ignoreCase": true}'),
+                         [u'a*b', u'axb', u'a?b', u'a_b', u'A_B'])
+
+    def test_filter_fields(self):
+        # the fields that aren't listed can't be filtered by
+        self.assertEqual(len(self.names(quantity=0)), 8)
+        self.assertEqual(len(self.names(quantity=0, name=u'a*')), 5)
+        store = FlatQueryStore(filter_fields=('quantity',))
+        data = store(self.factory.get('/', {'quantity': '0', 'name': u'a*'}))
+        self.assertEqual([item['name'] for item in data['items']], [u'a*b', u'50%', u'A_B'])
+        # nothing is filtered without filter_fields
+        class UnfilteredStore(FlatQueryStore):
+            class Meta:
+                objects = Flat.objects.order_by('pk')
+        self.assertEqual(len(UnfilteredStore()(self.factory.get('/', {'name': u'a*'}))['items']), 8)
+
+    def test_sort(self):
+        expected = [f.name for f in Flat.objects.order_by('-quantity', 'name')]
+        self.assertEqual(self.names(sort='-quantity,name'), expected)
+        expected = [f.name for f in Flat.objects.order_by('quantity', '-name')]
+        self.assertEqual(self.names(sort='quantity,-name'), expected)
+
+    def test_invalid_value(self):
+        objects = self.store.filter_objects(None, Flat.objects.all(), {'created': u'not a date'})
+        self.assertTrue(isinstance(objects, EmptyQuerySet))
+        self.assertEqual(self.names(created=u'not a date'), [])
+        self.assertEqual(len(self.names(created=fixtures.BASE_DATE.isoformat())), 8)
+
+    def test_page(self):
+        names = [f.name for f in Flat.objects.order_by('pk')]
+        def page(start, count):
+            cache.clear()
+            # the count and the rows of the page
+            with self.assertNumQueries(2):
+                data = self.store(self.factory.get('/', {'start': start, 'count': count}))
+            self.assertEqual(data['numRows'], 8)
+            return [item['name'] for item in data['items']]
+        self.assertEqual(page(0, 3), names[:3])
+        self.assertEqual(page(6, 3), names[6:])
+        # the objects are returned from start, even if it isn't a multiple of count
+        self.assertEqual(page(2, 3), names[2:5])
+        self.assertEqual(page(8, 3), [])
+        self.assertEqual(page(-1, 3), names[:3])
+
+class PagingTest(TestCase):
+
+    def setUp(self):
+        fixtures.create_flat(30)
+        # equal values of the sort field are ordered by the primary key
+        Flat.objects.filter(quantity__lt=10).update(quantity=0)
+
+    def pages(self, queryset, count, cursor=''):
+        """Returns the primary keys of the pages that follow each other."""
+        ret = []
+        start = 0
+        while True:
+            objects, cursor = paginate(queryset, start, count, cursor)
+            if not objects:
+                return ret
+            ret.extend([obj.pk for obj in objects])
+            start += len(objects)
+
+    def test_cursor(self):
+        for ordering in ('pk', '-pk', 'quantity', '-quantity', 'name', '-created'):
+            queryset = Flat.objects.order_by(ordering)
+            expected = list(queryset.order_by(ordering, ordering.startswith('-') and '-pk' or 'pk')
+                            .values_list('pk', flat=True))
+            self.assertEqual(self.pages(queryset, 7), expected, ordering)
+
+    def test_pk_ordering(self):
+        objects, cursor = paginate(Flat.objects.order_by('-pk'), 0, 10)
+        connection.use_debug_cursor = True
+        reset_queries()
+        try:
+            objects, cursor = paginate(Flat.objects.order_by('-pk'), 10, 10, cursor)
+            sql = connection.queries[-1]['sql']
+        finally:
+            connection.use_debug_cursor = False
+        self.assertEqual([obj.pk for obj in objects], range(20, 10, -1))
+        self.assertFalse(' OR ' in sql, sql)
+
+    def test_invalid_cursor(self):
+        queryset = Flat.objects.order_by('quantity')
+        expected = list(queryset.order_by('quantity', 'pk')[10:20])
+        objects, cursor = paginate(queryset, 0, 10)
+        # a cursor that was tampered with or doesn't match start falls back to the offset
+        tampered = cursor[:-1] + (cursor[-1] == 'a' and 'b' or 'a')
+        self.assertEqual(paginate(queryset, 10, 10, tampered)[0], expected)
+        self.assertEqual(paginate(queryset, 10, 10, 'garbage')[0], expected)
+        expected = list(queryset.order_by('quantity', 'pk')[15:25])
+        self.assertEqual(paginate(queryset, 15, 10, cursor)[0], expected)
+        # a cursor of another ordering
+        objects, cursor = paginate(queryset.order_by('-quantity'), 0, 10)
+        self.assertEqual(paginate(queryset, 10, 10, cursor)[0], list(queryset.order_by('quantity', 'pk')[10:20]))
+
+    def test_count(self):
+        queryset = Flat.objects.filter(quantity__gte=10)
+        self.assertEqual(get_count(queryset), (20, False))
+        self.assertEqual(get_count(Flat.objects.none(), 'cached'), (0, False))
+        cache.clear()
+        self.assertEqual(get_count(queryset, 'cached'), (20, False))
+        Flat.objects.filter(quantity=10).delete()
+        # the count is taken from the cache
+        self.assertEqual(get_count(queryset, 'cached'), (20, True))
+        self.assertEqual(get_count(queryset, 'exact'), (19, False))
+        # the statistics of sqlite aren't available before ANALYZE (and the table is small)
+        self.assertEqual(get_count(Flat.objects.all(), 'estimate'), (29, False))
+        self.assertEqual(get_count([1, 2, 3], 'estimate'), (3, False))
+        self.assertRaises(ValueError, get_count, queryset, 'guess')
+
+    def test_estimate(self):
+        cache.clear()
+        # the failing probe (there's no sqlite_stat1 yet) doesn't break the transaction
+        self.assertEqual(paging._estimate_count(Flat.objects.all()), None)
+        self.assertEqual(Flat.objects.count(), 30)
+        self.assertEqual(get_count(Flat.objects.all(), 'estimate'), (30, False))
+
+class DatagridListTest(TestCase):
+
+    def setUp(self):
+        # every book has its own author, the publishers are shared
+        publishers = [Publisher.objects.create(name=u'Publisher %d' % i, city=u'City') for i in xrange(3)]
+        category = Category.objects.create(name=u'Category')
+        for i in xrange(12):
+            author = Author.objects.create(name=u'Author %02d' % ((i * 5) % 12))
+            Book.objects.create(title=u'Book %d' % i, price='%d.50' % i, published=fixtures.BASE_DATE,
+                                author=author, publisher=publishers[i % 3], category=category)
+
+    def tearDown(self):
+        if hasattr(Book.author_name.im_func, 'order_field'):
+            del Book.author_name.im_func.order_field
+
+    def assertSameRows(self, **params):
+        params.setdefault('inclusions', 'author_name,publisher_name')
+        params.setdefault('start', '0')
+        params.setdefault('count', '5')
+        request = RequestFactory().get('/', params)
+        expected = self.decode(legacy.datagrid_list(request, 'benchapp', 'book'))
+        data = self.decode(datagrid_list(request, 'benchapp', 'book'))
+        self.assertEqual(data, expected)
+        return data
+
+    def decode(self, response):
+        data = json.loads(response.content[len("{}&&\n"):])
+        # the caches of the related objects depend on when the inclusions were called
+        for item in data['items']:
+            for k in item.keys():
+                if k.endswith('_cache'):
+                    del item[k]
+        return data
+
+    def test_inclusion_sort(self):
+        Book.author_name.im_func.order_field = 'author__name'
+        data = self.assertSameRows(sort='author_name')
+        self.assertEqual([item['author_name'] for item in data['items']],
+                         [u'Author %02d' % i for i in xrange(5)])
+        self.assertSameRows(sort='-author_name', start='3')
+
+    def test_method_sort(self):
+        # the publishers are shared, the ties keep the order of the rows
+        self.assertSameRows(sort='publisher_name')
+        self.assertSameRows(sort='-publisher_name', start='4', count='6')
+        self.assertSameRows(sort='-author_name', count='20')
+
+    def test_search(self):
+        self.assertSameRows(search='Book 1', search_fields='title,author__name')
+        self.assertSameRows(search='Author 05', search_fields='title,author__name', sort='publisher_name')
+
+    def test_related_inclusions(self):
+        # the relations the inclusions depend on are joined (a count and the rows)
+        for params in ({'sort': '-author_name'}, {'sort': 'title', 'dojango_fields': 'title'}):
+            params.update(inclusions='author_name,publisher_name', start='0', count='5')
+            request = RequestFactory().get('/', params)
+            self.assertNumQueries(2, datagrid_list, request, 'benchapp', 'book')
+
+    def test_projection(self):
+        params = {'inclusions': 'author_name', 'start': '0', 'count': '5', 'sort': 'title'}
+        data = self.decode(datagrid_list(RequestFactory().get('/', params), 'benchapp', 'book'))
+        self.assertTrue('price' in data['items'][0])
+        params['dojango_fields'] = 'title'
+        data = self.decode(datagrid_list(RequestFactory().get('/', params), 'benchapp', 'book'))
+        self.assertEqual(sorted(data['items'][0]), ['author_name', 'id', 'title'])
+
+    def test_template_projection(self):
+        # the grid just asks for the visible columns, if project_columns is set
+        grid = "{% load dojango_grid %}{% datagrid benchapp book %}list_display=('title','author_name')OPTIONS{% enddatagrid %}"
+        self.assertFalse('dojango_fields' in Template(grid.replace('OPTIONS', '')).render(Context({})))
+        out = Template(grid.replace('OPTIONS', '\nproject_columns=True')).render(Context({}))
+        self.assertTrue("'dojango_fields': 'title'" in out)
+
+    def test_prefetched_inclusions(self):
+        fixtures.create_m2m(20)
+        expected = sorted([u', '.join(sorted(tag.name for tag in article.tags.all()))
+                           for article in Article.objects.all()], reverse=True)
+        request = RequestFactory().get('/', {'inclusions': 'tag_names', 'sort': '-tag_names', 'start': '0', 'count': '20'})
+        # the count, the rows and the tags of all rows
+        with self.assertNumQueries(3):
+            response = datagrid_list(request, 'benchapp', 'article')
+        self.assertEqual([item['tag_names'] for item in self.decode(response)['items']], expected)
+
+    def test_export(self):
+        params = {'inclusions': 'author_name', 'sort': '-id', 'title__startswith': 'Book 1'}
+        request = RequestFactory().get('/', dict(params, start='0', count='100'))
+        listed = self.decode(datagrid_list(request, 'benchapp', 'book'))['items']
+        self.assertEqual(len(listed), 3)
+        # start and count are ignored
+        request = RequestFactory().get('/', dict(params, start='1', count='1'))
+        response = datagrid_export(request, 'benchapp', 'book', 'ndjson')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="book.ndjson"')
+        lines = ''.join(response.streaming_content).splitlines()
+        rows = [json.loads(line) for line in lines]
+        for row in rows:
+            for k in [k for k in row if k.endswith('_cache')]:
+                del row[k]
+        self.assertEqual(rows, listed)
+
+        response = datagrid_export(request, 'benchapp', 'book')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(''.join(response.streaming_content).splitlines()))
+        header = rows.pop(0)
+        self.assertEqual(header[:2], ['id', 'title'])
+        self.assertEqual(header[-1], 'author_name')
+        self.assertEqual([row[1] for row in rows], ['Book 11', 'Book 10', 'Book 1'])
+        self.assertEqual([row[-1] for row in rows], [item['author_name'] for item in listed])
+        self.assertEqual([Decimal(row[header.index('price')]) for row in rows],
+                         [Decimal('11.50'), Decimal('10.50'), Decimal('1.50')])
+        self.assertRaises(Http404, datagrid_export, request, 'benchapp', 'book', 'xml')
+
+    def test_batched_permissions(self):
+        calls = []
+        def access_model(app_name, model_name, request=None, instance=None):
+            calls.append('row')
+            return True
+        def access_field(app_name, model_name, field_name, request=None, instance=None):
+            calls.append('field')
+            return field_name not in ('price', '_state')
+        def filter_queryset(app_name, model_name, request, queryset):
+            calls.append('queryset')
+            return queryset.filter(title__startswith='Book 1')
+        def filter_fields(app_name, model_name, field_names, request):
+            calls.append('fields')
+            return [k for k in field_names if k not in ('price', '_state')]
+        request = RequestFactory().get('/', {'inclusions': 'author_name', 'start': '0', 'count': '5'})
+        data = self.decode(datagrid_list(request, 'benchapp', 'book', access_model_callback=access_model,
+                                         access_field_callback=access_field))
+        self.assertEqual(calls.count('row'), 5)
+        self.assertTrue(calls.count('field') > 5)
+        self.assertFalse('price' in data['items'][0])
+        # the batch functions are called once per request (and for new names) instead
+        del calls[:]
+        access_model.filter_queryset = filter_queryset
+        access_field.filter_fields = filter_fields
+        data = self.decode(datagrid_list(request, 'benchapp', 'book', access_model_callback=access_model,
+                                         access_field_callback=access_field))
+        self.assertEqual(calls[0], 'queryset')
+        self.assertEqual(set(calls[1:]), set(['fields']))
+        self.assertTrue(len(calls) <= 4)
+        self.assertEqual(data['numRows'], 3)
+        self.assertEqual(sorted(item['title'] for item in data['items']), ['Book 1', 'Book 10', 'Book 11'])
+        self.assertFalse('price' in data['items'][0])
+        # a filter_queryset function returning None denies the access
+        access_model.filter_queryset = lambda *args: None
+        self.assertRaises(Exception, datagrid_list, request, 'benchapp', 'book',
+                          access_model_callback=access_model, access_field_callback=access_field)
+
+@cached_json_response(models=[Author], vary_on=['q'])
+def author_names(request):
+    author_names.calls += 1
+    authors = Author.objects.filter(name__startswith=request.GET.get('q', ''))
+    return {'user': request.user.username, 'names': [a.name for a in authors]}
+
+class CachedJsonResponseTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        author_names.calls = 0
+        Author.objects.create(name=u'Alpha')
+        self.users = [User.objects.create(username=name) for name in ('a', 'b')]
+
+    def get(self, user=None, **headers):
+        request = RequestFactory().get('/', {'q': 'A'}, **headers)
+        request.user = user or AnonymousUser()
+        return author_names(request)
+
+    def test_cached(self):
+        first = self.get()
+        self.assertEqual(author_names.calls, 1)
+        second = self.get()
+        self.assertEqual(author_names.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(second['ETag'], first['ETag'])
+        # an instance of the models invalidates the responses
+        Author.objects.create(name=u'Another')
+        self.assertTrue(u'Another' in self.get().content)
+        self.assertEqual(author_names.calls, 2)
+
+    def test_users(self):
+        contents = [self.get(user).content for user in [None] + self.users]
+        self.assertEqual(author_names.calls, 3)
+        self.assertEqual(len(set(contents)), 3)
+        self.assertTrue('"user": "b"' in self.get(self.users[1]).content)
+        self.assertEqual(author_names.calls, 3)
+
+    def test_not_modified(self):
+        tag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=tag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(author_names.calls, 1)
+
+class CoalesceRequestsTest(TestCase):
+    views = 0
+
+    def setUp(self):
+        self.coalesce_requests = dojango_settings.COALESCE_REQUESTS
+        dojango_settings.COALESCE_REQUESTS = True
+        self.calls = 0
+
+    def tearDown(self):
+        dojango_settings.COALESCE_REQUESTS = self.coalesce_requests
+
+    def view(self, cookie=False, vary=False, wait=None):
+        def view(request):
+            self.calls += 1
+            if wait is not None:
+                wait.wait(5)
+            ret = HttpResponse('%s %d' % (self.id(), self.calls), content_type='text/plain')
+            if cookie:
+                ret.set_cookie('token', str(self.calls))
+            if vary:
+                ret['Vary'] = 'Accept-Encoding, Cookie'
+            return ret
+        # (every view has keys of its own)
+        CoalesceRequestsTest.views += 1
+        view.__name__ = 'view_%d' % self.views
+        return view
+
+    def get(self, view, user=None):
+        request = RequestFactory().get('/', {'q': 'x'})
+        request.user = user or AnonymousUser()
+        return view(request)
+
+    def test_window(self):
+        view = coalesce_requests(window=10)(self.view())
+        first, second = self.get(view), self.get(view)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], 'text/plain')
+        # the user is part of the key
+        self.get(view, User.objects.create(username='a'))
+        self.assertEqual(self.calls, 2)
+
+    def test_single_flight(self):
+        wait = threading.Event()
+        view = coalesce_requests()(self.view(wait=wait))
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(self.get(view))) for i in range(3)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        wait.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(set([r.content for r in responses])), 1)
+        # without a window the next request calls the view
+        self.get(view)
+        self.assertEqual(self.calls, 2)
+
+    def test_cookies(self):
+        view = coalesce_requests(window=10)(self.view(cookie=True))
+        first, second = self.get(view), self.get(view)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(first.cookies['token'].value, '1')
+        self.assertEqual(second.cookies['token'].value, '2')
+        view = coalesce_requests(window=10)(self.view(vary=True))
+        self.assertNotEqual(self.get(view).content, self.get(view).content)
+
+class DatagridAggregatesTest(TestCase):
+
+    def setUp(self):
+        fixtures.create_flat(10)
+
+    def aggregates(self, value, **params):
+        params['dojango_aggregates'] = value
+        response = datagrid_aggregates(RequestFactory().get('/', params), 'benchapp', 'flat')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content[len("{}&&\n"):])
+
+    def test_aggregates(self):
+        data = self.aggregates('quantity:sum,quantity:max,id:count', quantity__lt=5)
+        self.assertEqual(data['aggregates'], {'quantity': {'sum': 10, 'max': 4}, 'id': {'count': 5}})
+
+    def test_invalid(self):
+        for value in ('quantity', 'quantity:median', 'nope:sum', 'quantity:'):
+            data = self.aggregates(value)
+            self.assertEqual(data['success'], False)
+            self.assertFalse('aggregates' in data)
+            self.assertTrue(data['error'])
+
+class BenchmarkRunTest(TestCase):
+
+    def test_paths(self):
+        import run
+        for dataset, (fixture, model_name, store_name, query_store_name) in sorted(run.DATASETS.items()):
+            getattr(fixtures, fixture)(30)
+            for path in run.PATHS:
+                runner = run.get_runner(dataset, path, 30)
+                if runner is None:
+                    continue
+                self.assertTrue(runner(), (dataset, path))
+                self.assertTrue(run.count_queries(runner) > 0, (dataset, path))
+        self.assertEqual(run.get_runner('flat', 'datagrid_sort_inclusion', 30), None)
+        self.assertRaises(ValueError, run.get_runner, 'flat', 'nope', 30)
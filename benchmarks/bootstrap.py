@@ -0,0 +1,30 @@
+"""
+Sets up the throwaway django project of the benchmarks (see settings.py).
+"""
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def setup(db_path=None):
+    """
+    Makes dojango and the benchmark project importable and creates the tables
+    of the benchmark database (if they don't exist yet). If no db_path is
+    given, a new database is created in a temporary directory.
+    """
+    for path in (os.path.dirname(BENCH_DIR), BENCH_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    if db_path:
+        os.environ['DOJANGO_BENCH_DB'] = db_path
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+def max_rss():
+    """
+    Returns the peak resident set size of the current process
+    (kilobytes on linux, bytes on mac os).
+    """
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,63 @@
+"""
+Generators for the benchmark data. Each dataset is created with the given
+number of rows of its main model (see DATASETS in run.py).
+"""
+import datetime
+from decimal import Decimal
+
+BASE_DATE = datetime.datetime(2012, 1, 1, 12, 0)
+
+def create_flat(rows):
+    from benchapp.models import Flat
+    _bulk_create(Flat, [Flat(
+        name=u'Item %d' % i,
+        description=u'Description of item %d \u2013 ' % i * 5,
+        amount=Decimal('%d.%02d' % (i, i % 100)),
+        quantity=i,
+        ratio=i / 7.0,
+        active=bool(i % 2),
+        created=BASE_DATE + datetime.timedelta(minutes=i),
+        day=(BASE_DATE + datetime.timedelta(days=i % 1000)).date(),
+    ) for i in xrange(rows)])
+
+def create_fk(rows):
+    from benchapp.models import Author, Publisher, Category, Book
+    authors = max(1, rows / 10)
+    publishers = max(1, rows / 50)
+    categories = 20
+    Author.objects.bulk_create([Author(id=i + 1, name=u'Author %d' % i) for i in xrange(authors)])
+    Publisher.objects.bulk_create([Publisher(id=i + 1, name=u'Publisher %d' % i, city=u'City %d' % (i % 30))
+                                   for i in xrange(publishers)])
+    Category.objects.bulk_create([Category(id=i + 1, name=u'Category %d' % i) for i in xrange(categories)])
+    _bulk_create(Book, [Book(
+        title=u'Book %d' % i,
+        price=Decimal('%d.%02d' % (i % 100, i % 100)),
+        published=BASE_DATE + datetime.timedelta(hours=i),
+        author_id=i % authors + 1,
+        publisher_id=i % publishers + 1,
+        category_id=i % categories + 1,
+    ) for i in xrange(rows)])
+
+def create_m2m(rows, tags_per_article=3):
+    from benchapp.models import Tag, Article
+    tags = max(tags_per_article, rows / 20)
+    Tag.objects.bulk_create([Tag(id=i + 1, name=u'Tag %d' % i) for i in xrange(tags)])
+    _bulk_create(Article, [Article(id=i + 1, title=u'Article %d' % i, body=u'Text of article %d. ' % i * 10)
+                           for i in xrange(rows)])
+    Through = Article.tags.through
+    _bulk_create(Through, [Through(article_id=i + 1, tag_id=(i + j) % tags + 1)
+                           for i in xrange(rows) for j in xrange(tags_per_article)])
+
+def create_tree(rows, children_per_node=10):
+    from benchapp.models import Node
+    # node i is a child of node (i - 1) / children_per_node, node 0 is the root
+    _bulk_create(Node, [Node(
+        id=i + 1,
+        name=u'Node %d' % i,
+        parent_id=i and (i - 1) / children_per_node + 1 or None,
+    ) for i in xrange(rows)])
+
+def _bulk_create(model, objects, batch_size=500):
+    # sqlite limits the number of variables of a single query
+    for i in xrange(0, len(objects), batch_size):
+        model.objects.bulk_create(objects[i:i + batch_size])
@@ -0,0 +1,137 @@
+"""
+The json_encode implementation and the datagrid_list view of dojango 0.5.8.
+json_encode builds a copy of the data out of lists and dicts and passes it to
+json.dumps afterwards, datagrid_list sorts by inclusions in python. They are
+kept as the reference the current implementation is compared to.
+"""
+import datetime
+import json
+import operator
+from decimal import Decimal
+
+from django.core.serializers.json import DateTimeAwareJSONEncoder
+from django.db import models
+from django.db.models import Model, get_model
+from django.db.models import ImageField, FileField
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_unicode
+from django.utils.functional import Promise
+
+def json_encode(data):
+
+    def _any(data):
+        ret = None
+        if isinstance(data, list):
+            ret = _list(data)
+        elif isinstance(data, dict):
+            ret = _dict(data)
+        elif isinstance(data, Decimal):
+            ret = str(data)
+        elif isinstance(data, QuerySet):
+            ret = _list(data)
+        elif isinstance(data, Model):
+            ret = _model(data)
+        elif isinstance(data, basestring):
+            ret = unicode(data)
+        elif isinstance(data, Promise):
+            ret = force_unicode(data)
+        elif isinstance(data, datetime.datetime):
+            ret = str(data).replace(' ', 'T')
+        elif isinstance(data, datetime.date):
+            ret = str(data)
+        elif isinstance(data, datetime.time):
+            ret = "T" + str(data)
+        else:
+            ret = data
+        return ret
+
+    def _model(data):
+        ret = {}
+        for f in data._meta.fields:
+            if isinstance(f, ImageField) or isinstance(f, FileField):
+                ret[f.attname] = unicode(getattr(data, f.attname))
+            else:
+                ret[f.attname] = _any(getattr(data, f.attname))
+        fields = dir(data.__class__) + ret.keys()
+        add_ons = [k for k in dir(data) if k not in fields and k not in ('delete', '_state',)]
+        for k in add_ons:
+            ret[k] = _any(getattr(data, k))
+        return ret
+
+    def _list(data):
+        ret = []
+        for v in data:
+            ret.append(_any(v))
+        return ret
+
+    def _dict(data):
+        ret = {}
+        for k,v in data.items():
+            ret[k] = _any(v)
+        return ret
+
+    ret = _any(data)
+    return json.dumps(ret, cls=DateTimeAwareJSONEncoder)
+
+# the datagrid_list view (see dojango.views)
+
+AVAILABLE_OPTS =  ('search_fields','prof','inclusions','sort','search','count','order','start')
+
+def datagrid_list(request, app_name, model_name):
+    from dojango.decorators import json_response
+    from dojango.util import to_dojo_data
+    from dojango.util.perms import access_model, access_model_field
+
+    @json_response
+    def view(request, app_name, model_name, access_model_callback=access_model, access_field_callback=access_model_field):
+        model = get_model(app_name,model_name)
+        target = model.objects.all()
+        for key in [ d for d in request.GET.keys() if not d in AVAILABLE_OPTS]:
+            target = target.filter(**{str(key):request.GET[key]})
+        num = target.count()
+
+        if request.GET.has_key('search') and request.GET.has_key('search_fields'):
+            ored = [models.Q(**{str(k).strip(): unicode(request.GET['search'])} ) for k in request.GET['search_fields'].split(",")]
+            target = target.filter(reduce(operator.or_, ored))
+
+        if request.GET.has_key('sort') and request.GET["sort"] not in request.GET["inclusions"] and request.GET["sort"][1:] not in request.GET["inclusions"]:
+            target = target.order_by(request.GET['sort'])
+        else:
+            if request.GET.has_key('sort') and request.GET["sort"].startswith('-'):
+                target = sorted(target, lambda x,y: cmp(getattr(x,request.GET["sort"][1:])(),getattr(y,request.GET["sort"][1:])()));
+                target.reverse();
+            elif request.GET.has_key('sort'):
+                target =  sorted(target, lambda x,y: cmp(getattr(x,request.GET["sort"])(),getattr(y,request.GET["sort"])()));
+
+        target=target[int(request.GET['start']):int(request.GET['start'])+int(request.GET['count'])]
+        complete = []
+        for data in target:
+            if access_model_callback(app_name, model_name, request, data):
+                ret = {}
+                for f in data._meta.fields:
+                    if access_field_callback(app_name, model_name, f.attname, request, data):
+                        if isinstance(f, models.ImageField) or isinstance(f, models.FileField):
+                            ret[f.attname] = unicode(getattr(data, f.attname))
+                        else:
+                            ret[f.attname] = getattr(data, f.attname)
+                fields = dir(data.__class__) + ret.keys()
+                add_ons = [k for k in dir(data) if k not in fields and access_field_callback(app_name, model_name, k, request, data)]
+                for k in add_ons:
+                    ret[k] = getattr(data, k)
+                if request.GET.has_key('inclusions'):
+                    for k in request.GET['inclusions'].split(','):
+                        if k == "": continue
+                        if access_field_callback(app_name, model_name, k, request, data):
+                            try:
+                                ret[k] = getattr(data,k)()
+                            except:
+                                try:
+                                    ret[k] = eval("data.%s"%".".join(k.split("__")))
+                                except:
+                                    ret[k] = getattr(data,k)
+                complete.append(ret)
+            else:
+                raise Exception, "You're not allowed to query the model '%s.%s' (add it to the array of the DOJANGO_DATAGRID_ACCESS setting)" % (model_name, app_name)
+        return to_dojo_data(complete, identifier=model._meta.pk.name, num_rows=num)
+
+    return view(request, app_name, model_name)
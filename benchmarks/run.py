@@ -0,0 +1,245 @@
+"""
+Runs the benchmarks of dojango's serialization hot paths.
+
+For every dataset and size a sqlite database is created (see fixtures.py),
+then every path is measured in a fresh python process:
+
+    json_encode                json_encode(to_dojo_data(QuerySet))
+    store_to_json              Store.to_json() of a modelstore Store
+    model_query_store          a page in the middle of a ModelQueryStore
+    datagrid_list              a page of the datagrid_list view
+    datagrid_sort_inclusion    datagrid_list sorted by an inclusion (fk only)
+    piston_emitter             the DojoDataEmitter (if piston is installed)
+
+For each run the time (min and mean of the repeats), the number of database
+queries, the growth of the peak memory (kilobytes on linux, bytes on mac os)
+and, where tracemalloc is available, the peak of the traced allocations are
+reported as json.
+
+Usage:
+    python benchmarks/run.py [options]
+    python benchmarks/run.py --sizes 1000 --datasets fk --paths json_encode,datagrid_list
+"""
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import bootstrap
+
+DATASETS = {
+    # name: (fixture function, model, Store, ModelQueryStore)
+    'flat': ('create_flat', 'Flat', 'FlatStore', 'FlatQueryStore'),
+    'fk': ('create_fk', 'Book', 'BookStore', 'BookQueryStore'),
+    'm2m': ('create_m2m', 'Article', 'ArticleStore', 'ArticleQueryStore'),
+    'tree': ('create_tree', 'Node', 'NodeStore', 'NodeQueryStore'),
+}
+PATHS = ('json_encode', 'store_to_json', 'model_query_store', 'datagrid_list',
+         'datagrid_sort_inclusion', 'piston_emitter')
+# the "inclusions" (model methods) that are passed to datagrid_list
+INCLUSIONS = {
+    'fk': 'author_name,publisher_name',
+}
+
+def create(dataset, rows, db_path):
+    bootstrap.setup(db_path)
+    import fixtures
+    from django.db import transaction
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    getattr(fixtures, DATASETS[dataset][0])(rows)
+    transaction.commit()
+    transaction.leave_transaction_management()
+
+def get_runner(dataset, path, rows):
+    """
+    Returns a function that runs the path on the dataset or None, if the path
+    can't be run.
+    """
+    from django.db.models import get_model
+    from django.test.client import RequestFactory
+    from benchapp import stores
+    from dojango.util import json_encode, to_dojo_data
+
+    fixture, model_name, store_name, query_store_name = DATASETS[dataset]
+    model = get_model('benchapp', model_name)
+    factory = RequestFactory()
+
+    if path == 'json_encode':
+        return lambda: json_encode(to_dojo_data(model.objects.all(), num_rows=rows))
+    elif path == 'store_to_json':
+        # a new QuerySet for each run, the results would be cached otherwise
+        def run():
+            objects = model.objects.all()
+            if dataset == 'tree':
+                # the children are rendered recursively
+                objects = objects.filter(parent=None)
+            return getattr(stores, store_name)(objects=objects).to_json()
+        return run
+    elif path == 'model_query_store':
+        request = factory.get('/', {'start': rows // 2, 'count': 25})
+        def run():
+            data = getattr(stores, query_store_name)(objects=model.objects.all())(request)
+            if not isinstance(data, basestring):
+                data = json_encode(data)
+            return data
+        return run
+    elif path in ('datagrid_list', 'datagrid_sort_inclusion'):
+        from dojango.views import datagrid_list
+        inclusions = INCLUSIONS.get(dataset, '')
+        if path == 'datagrid_list':
+            sort = '-id'
+        elif inclusions:
+            sort = '-' + inclusions.split(',')[0]
+        else:
+            return None
+        request = factory.get('/', {'start': rows // 2, 'count': 25, 'sort': sort, 'inclusions': inclusions})
+        return lambda: datagrid_list(request, 'benchapp', model_name.lower()).content
+    elif path == 'piston_emitter':
+        try:
+            from piston.handler import typemapper
+            from dojango.data.piston.emitters import DojoDataEmitter
+        except ImportError:
+            return None
+        from benchapp import handlers
+        handler = getattr(handlers, model_name + 'Handler')()
+        request = factory.get('/')
+        return lambda: DojoDataEmitter(model.objects.all(), typemapper, handler,
+                                       handler.fields, False).render(request)
+    raise ValueError("Unknown path '%s'" % path)
+
+def count_queries(func):
+    """Returns the number of database queries of the call."""
+    from django.db import connection, reset_queries
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    reset_queries()
+    try:
+        func()
+        return len(connection.queries)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+        reset_queries()
+
+def measure(dataset, rows, path, db_path, repeat):
+    bootstrap.setup(db_path)
+    run = get_runner(dataset, path, rows)
+    if run is None:
+        return None
+    run() # warm up the caches
+    gc.collect()
+
+    rss_before = bootstrap.max_rss()
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        run()
+        timings.append(time.time() - start)
+        if i == 0:
+            peak_growth = bootstrap.max_rss() - rss_before
+    result = {
+        'dataset': dataset,
+        'rows': rows,
+        'path': path,
+        'min_seconds': min(timings),
+        'mean_seconds': sum(timings) / len(timings),
+        'queries': count_queries(run),
+        'peak_memory_growth': peak_growth,
+    }
+    try:
+        import tracemalloc
+    except ImportError:
+        pass
+    else:
+        gc.collect()
+        tracemalloc.start()
+        run()
+        result['traced_memory_peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def environment():
+    import sqlite3
+    import django
+    import dojango
+    from dojango.conf import settings as dojango_settings
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'django': django.get_version(),
+        'dojango': dojango.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'json_backend': dojango_settings.JSON_BACKEND,
+    }
+
+def call_child(*args):
+    child = subprocess.Popen([sys.executable, __file__] + [str(arg) for arg in args],
+                             stdout=subprocess.PIPE)
+    out, err = child.communicate()
+    if child.returncode:
+        raise SystemExit('Running %s failed' % ' '.join([str(arg) for arg in args]))
+    return json.loads(out)
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', default='1000,10000,100000',
+                      help='comma separated numbers of rows [%default]')
+    parser.add_option('-d', '--datasets', default=','.join(sorted(DATASETS)),
+                      help='comma separated datasets [%default]')
+    parser.add_option('-p', '--paths', default=','.join(PATHS),
+                      help='comma separated paths [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='number of timed runs of each path [%default]')
+    parser.add_option('-o', '--output', help='write the results to this file instead of stdout')
+    options, args = parser.parse_args()
+
+    datasets = options.datasets.split(',')
+    paths = options.paths.split(',')
+    for name in datasets:
+        if name not in DATASETS:
+            parser.error("Unknown dataset '%s'" % name)
+    for name in paths:
+        if name not in PATHS:
+            parser.error("Unknown path '%s'" % name)
+
+    results = []
+    tmp_dir = tempfile.mkdtemp(prefix='dojango-bench-')
+    try:
+        for dataset in datasets:
+            for rows in [int(size) for size in options.sizes.split(',')]:
+                db_path = os.path.join(tmp_dir, '%s-%d.db' % (dataset, rows))
+                call_child('--create', dataset, rows, db_path)
+                for path in paths:
+                    result = call_child('--measure', dataset, rows, path, db_path, options.repeat)
+                    if result is not None:
+                        results.append(result)
+                        print >> sys.stderr, '%(dataset)s %(rows)d %(path)s: %(min_seconds).4fs, %(queries)d queries' % result
+        env = call_child('--environment')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    output = json.dumps({'environment': env, 'results': results}, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--create':
+        create(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+        print json.dumps(None)
+    elif len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        print json.dumps(measure(sys.argv[2], int(sys.argv[3]), sys.argv[4], sys.argv[5], int(sys.argv[6])))
+    elif len(sys.argv) > 1 and sys.argv[1] == '--environment':
+        bootstrap.setup()
+        print json.dumps(environment())
+    else:
+        main()
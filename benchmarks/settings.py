@@ -0,0 +1,23 @@
+# Settings of the throwaway django project that is used by the benchmarks.
+# The sqlite database is given by the DOJANGO_BENCH_DB environment variable
+# (see bootstrap.py), otherwise it is created in a temporary directory.
+import os
+import tempfile
+
+DEBUG = False
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DOJANGO_BENCH_DB') or
+                os.path.join(tempfile.mkdtemp(prefix='dojango-bench-'), 'bench.db'),
+    }
+}
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'dojango',
+    'benchapp',
+)
+SECRET_KEY = 'dojango-benchmarks'
+ROOT_URLCONF = 'dojango.urls'
+DOJANGO_DATAGRID_ACCESS = ('benchapp',)
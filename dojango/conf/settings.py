@@ -22,6 +22,20 @@ DOJO_THEME = getattr(settings, "DOJANGO_DOJO_THEME", "claro")
 DOJO_DEBUG = getattr(settings, "DOJANGO_DOJO_DEBUG", DEBUG) # using the default django DEBUG setting
 DOJO_SECURE_JSON = getattr(settings, "DOJANGO_DOJO_SECURE_JSON", True) # if you are using dojo version < 1.2.0 you have set it to False
 CDN_USE_SSL = getattr(settings, "DOJANGO_CDN_USE_SSL", False) # is dojo served via https from google? doesn't work for aol!
+# which json library is used for dumps/loads: 'json', 'simplejson', 'ujson', 'orjson' or 'auto' (see dojango/util/json_backend.py)
+JSON_BACKEND = getattr(settings, "DOJANGO_JSON_BACKEND", "json")
+# the Cache-Control header of json responses that are using an ETag (see dojango.util.to_json_response)
+JSON_CACHE_CONTROL = getattr(settings, "DOJANGO_JSON_CACHE_CONTROL", "private, max-age=0, must-revalidate")
+# the full-text search backends of the datagrid per model: {'app.model': {'backend': ..., 'fields': (...)}} (see dojango/util/search.py)
+DATAGRID_SEARCH = getattr(settings, "DOJANGO_DATAGRID_SEARCH", {})
+# how numRows is counted: 'exact', 'cached' or 'estimate', or a dict of the strategy per endpoint (see dojango/util/paging.py)
+COUNT_STRATEGY = getattr(settings, "DOJANGO_COUNT_STRATEGY", "exact")
+# the seconds a count of the 'cached' (and 'estimate') strategy is cached
+COUNT_CACHE_TIMEOUT = getattr(settings, "DOJANGO_COUNT_CACHE_TIMEOUT", 60)
+# coalesce identical concurrent requests of datagrid_list and the ModelQueryStore (see dojango/util/coalesce.py)
+COALESCE_REQUESTS = getattr(settings, "DOJANGO_COALESCE_REQUESTS", False)
+# the seconds the result of a coalesced request is reused for identical requests
+COALESCE_WINDOW = getattr(settings, "DOJANGO_COALESCE_WINDOW", 0)
 
 # set the urls for actual possible paths for dojo
 # one dojo profile must at least contain a path that defines the base url of a dojo installation
@@ -1,3 +1,5 @@
+import threading
+
 import utils
 from exceptions import FieldException
 import methods
@@ -95,6 +97,19 @@ class StoreField(object):
         # Proxied arguments (ie, RequestArg, ObjectArg etc.)
         self.proxied_args = {}
 
+    def _get_local(self):
+        # Created on demand, in case a subclass doesn't call __init__
+        return self.__dict__.setdefault('_local', threading.local())
+
+    def _get_proxied_args(self):
+        """ The proxied arguments of the object that is serialized
+            by the current thread (see BaseStore._get_field_value)
+        """
+        return getattr(self._get_local(), 'proxied_args', {})
+    def _set_proxied_args(self, proxied_args):
+        self._get_local().proxied_args = proxied_args
+    proxied_args = property(_get_proxied_args, _set_proxied_args)
+
     def _get_sort_field(self):
         """ Return the name of the field to be passed to
             QuerySet.order_by().
@@ -129,6 +144,23 @@ class StoreField(object):
         return self._model_field_name or self._store_attr_name
     model_field_name = property(_get_model_field_name)
 
+    def _get_related_path(self):
+        """ Return the dotted path of the attributes that get_value() follows
+            from the object (ie 'author.name'), or None if it isn't known.
+
+            The Store selects or prefetches the relations on this path, so they
+            aren't fetched for each object (see BaseStore.prefetch_objects).
+        """
+        if methods._defining_class(type(self), 'compile') is not methods._defining_class(type(self), 'get_value'):
+            return None
+        if not self._get_value or isinstance(self._get_value, methods.ValueMethod):
+            return self.model_field_name
+        if isinstance(self._get_value, methods.ObjectMethod) and \
+                isinstance(self._get_value.method_or_methodname, (str, unicode)):
+            return self._get_value.method_or_methodname
+        return None
+    related_path = property(_get_related_path)
+
     def get_value(self):
         """ Returns the value for this field
         """
@@ -138,6 +170,30 @@ class StoreField(object):
 
         return self._get_value()
 
+    def compile(self):
+        """ Returns a function accessor(obj, store) that returns the value
+            of this field for the given object, or None if the value has to
+            be computed by get_value() (using the proxied_args).
+
+            The Store compiles its fields when the Store class is created
+            (see StoreMetaclass), fields that override get_value() aren't
+            compiled unless they override compile() as well.
+        """
+        if methods._defining_class(type(self), 'compile') is not methods._defining_class(type(self), 'get_value'):
+            return None
+        return self._compile_get_value()
+
+    def _compile_get_value(self):
+        """ Compiles the get_value method (an ObjectMethod of the model field
+            if none was given).
+        """
+        if not self._get_value:
+            return methods.ObjectMethod(self.model_field_name).compile(self)
+        if isinstance(self._get_value, methods.BaseMethod):
+            return self._get_value.compile(self)
+        get_value = self._get_value
+        return lambda obj, store: get_value()
+
 class ReferenceField(StoreField):
     """ A StoreField that handles '_reference' items
 
@@ -155,13 +211,25 @@ class ReferenceField(StoreField):
         # The Store we're attached to
         store = self.proxied_args['StoreArg']
 
-        items = []
-
         if not self._get_value:
             self._get_value = methods.ObjectMethod(self.model_field_name)
             self._get_value.field = self
 
-        related = self._get_value()
+        return self._get_references(store, self._get_value())
+
+    def compile(self):
+        if methods._defining_class(type(self), 'compile') is not methods._defining_class(type(self), 'get_value'):
+            return None
+        get_related = self._compile_get_value()
+        if get_related is None:
+            return None
+        get_references = self._get_references
+        return lambda obj, store: get_references(store, get_related(obj, store))
+
+    def _get_references(self, store, related):
+        """ Returns the reference(s) to the related object(s)
+        """
+        items = []
 
         if not bool(related):
             return items
@@ -172,7 +240,11 @@ class ReferenceField(StoreField):
 
         # Django Queryset or Manager
         if hasattr(related, 'iterator'):
-            related = related.iterator()
+            if hasattr(related, 'get_query_set'):
+                # The QuerySet of a Manager holds the prefetched objects (if any)
+                related = related.all()
+            if getattr(related, '_result_cache', None) is None:
+                related = related.iterator()
 
         try:
             for item in related:
@@ -192,6 +264,16 @@ class DojoDateField(StoreField):
 
     def get_value(self):
 
-        self._get_value = methods.DojoDateMethod
-        self._get_value.field = self
-        return self._get_value()
+        # Each field has its own copy of the DojoDateMethod, the shared
+        # one can't be attached to the fields of all threads at once
+        method = self.__dict__.get('_date_method')
+        if method is None:
+            method = self._date_method = methods.ValueMethod('strftime', methods.DOJO_DATE_FORMAT)
+            method.field = self
+        self._get_value = method
+        return method()
+
+    def compile(self):
+        if methods._defining_class(type(self), 'compile') is not methods._defining_class(type(self), 'get_value'):
+            return None
+        return methods.DojoDateMethod.compile(self)
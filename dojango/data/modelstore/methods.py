@@ -1,3 +1,5 @@
+import threading
+
 import utils
 from exceptions import MethodException
 
@@ -54,11 +56,40 @@ class FieldArg(Arg):
     pass
 
 
+# The names of the placeholder arguments, that are replaced by the proxied_args
+PROXIED_ARGS = ('RequestArg', 'ModelArg', 'ObjectArg', 'StoreArg', 'FieldArg')
+
+def _proxied_arg(arg):
+    """ Returns the name of the placeholder argument or None
+    """
+    name = getattr(arg, '__name__', None)
+    if name in PROXIED_ARGS:
+        return name
+    return None
+
+def _defining_class(cls, name):
+    """ Returns the class in cls.__mro__ that defines the attribute name
+    """
+    for c in cls.__mro__:
+        if name in c.__dict__:
+            return c
+    return None
+
+def _value_target(obj, store, field):
+    """ The target of a compiled ValueMethod: the value of the field
+    """
+    return utils.resolve_dotted_attribute(obj, field.model_field_name)
+
 class BaseMethod(object):
     """ The base class from which all proxied methods
         derive.
     """
 
+    # How the compiled method gets the object the method is looked up on,
+    # a function (obj, store, field) -> target. None if the method can't be
+    # compiled (see compile).
+    _compiled_target = None
+
     def __init__(self, method_or_methodname, *args, **kwargs):
         """ The first argument is either the name of a method
             or the method object itself (ie, pointer to the method)
@@ -77,43 +108,149 @@ class BaseMethod(object):
         """
 
         self.method_or_methodname = method_or_methodname
-        self.args = args
-        self.kwargs = kwargs
+        self._args = args
+        self._kwargs = kwargs
         self.field = None # Don't have a handle on the field yet
 
+    def _get_local(self):
+        # The built arguments of the current call per thread, created
+        # on demand, in case a subclass doesn't call __init__
+        return self.__dict__.setdefault('_local', threading.local())
+
+    def _get_args(self):
+        """ The arguments of the current call (see _build_args),
+            outside of a call the arguments as given.
+        """
+        return getattr(self._get_local(), 'args', self._args)
+    def _set_args(self, args):
+        self._args = args
+    args = property(_get_args, _set_args)
+
+    def _get_kwargs(self):
+        """ The keyword arguments of the current call (see _build_args),
+            outside of a call the keyword arguments as given.
+        """
+        return getattr(self._get_local(), 'kwargs', self._kwargs)
+    def _set_kwargs(self, kwargs):
+        self._kwargs = kwargs
+    kwargs = property(_get_kwargs, _set_kwargs)
+
     def __call__(self):
         """ Builds the arguments and returns the value of the method call
         """
-
+        # The arguments of an outer call (if the method is called
+        # reentrantly) are restored afterwards
+        local = self._get_local()
+        previous = local.__dict__.copy()
         self._build_args()
-        return self.get_value()
+        try:
+            return self.get_value()
+        finally:
+            local.__dict__.clear()
+            local.__dict__.update(previous)
 
     def _build_args(self):
         """ Builds the arguments to be passed to the given method
 
             Substitutes placeholder args (ie RequestArg, ObjectArg etc.)
-            with the actual objects.
+            with the actual objects. The arguments as given aren't changed,
+            the built ones are just available to the current thread.
         """
 
         args = []
-        for arg in self.args:
+        for arg in self._args:
             try:
                 arg = self.field.proxied_args.get(arg.__name__, arg)
             except AttributeError: # No __name__ attr on the arg
                 pass
             args.append(arg)
-        self.args = args
+        self._get_local().args = args
 
-        for key, val in self.kwargs.items():
-            self.kwargs.update({
-                key: self.field.proxied_args.get(hasattr(val, '__name__') and val.__name__ or val, val)
-            })
+        kwargs = {}
+        for key, val in self._kwargs.items():
+            kwargs[key] = self.field.proxied_args.get(hasattr(val, '__name__') and val.__name__ or val, val)
+        self._get_local().kwargs = kwargs
 
     def get_value(self):
         """ Calls the given method with the requested arguments.
         """
         raise NotImplementedError('get_value() not implemented in BaseMethod')
 
+    def compile(self, field):
+        """ Returns a function accessor(obj, store), that returns the value
+            of this method for the given object and store, or None if the
+            method can't be compiled.
+
+            The accessor resolves the method the same way as get_value(),
+            but just substitutes the placeholder args that are actually
+            used and doesn't need the proxied_args of the field, so the
+            store can call it in a tight loop (see BaseStore._serialize).
+
+            Methods that override get_value() aren't compiled, unless they
+            define their own _compiled_target.
+        """
+        cls = type(self)
+        if self._compiled_target is None or \
+                _defining_class(cls, '_compiled_target') is not _defining_class(cls, 'get_value'):
+            return None
+        get_target = self._compiled_target
+
+        # Resolve the method (or the dotted attribute names) once
+        method = self.method_or_methodname
+        if callable(method):
+            names = None
+        elif isinstance(method, (str, unicode)):
+            names = method.split('.')
+            for name in names:
+                if name.startswith('_') and name != '__unicode__':
+                    # resolve_dotted_attribute raises an exception for each object
+                    return None
+        else:
+            return None
+
+        # Which placeholder args are used
+        args = list(self._args)
+        kwargs = dict(self._kwargs)
+        proxied = [(i, _proxied_arg(arg)) for i, arg in enumerate(args) if _proxied_arg(arg)]
+        proxied_kwargs = [(key, _proxied_arg(val)) for key, val in kwargs.items() if _proxied_arg(val)]
+
+        def accessor(obj, store):
+            target = get_target(obj, store, field)
+            if target is None and get_target is _value_target:
+                # Prevent throwing a MethodException if the value is None
+                return None
+            if names is None:
+                m = method
+            else:
+                m = target
+                try:
+                    for name in names:
+                        m = getattr(m, name)
+                except AttributeError:
+                    raise MethodException('Cannot resolve method "%s" in object "%s"' % (
+                        method, type(target)
+                    ))
+                if not callable(m):
+                    # Arguments to a non-callable are ignored
+                    return m
+            if not (proxied or proxied_kwargs):
+                return m(*args, **kwargs)
+            values = {
+                'RequestArg': store.request,
+                'ModelArg': obj.__class__,
+                'ObjectArg': obj,
+                'StoreArg': store,
+                'FieldArg': field,
+            }
+            call_args = args[:]
+            for i, name in proxied:
+                call_args[i] = values[name]
+            call_kwargs = kwargs.copy()
+            for key, name in proxied_kwargs:
+                call_kwargs[key] = values[name]
+            return m(*call_args, **call_kwargs)
+        return accessor
+
     def get_method(self, obj=None):
         """ Resolves the given method into a callable object.
 
@@ -219,13 +356,23 @@ class Method(BaseMethod):
                     >>>     ...
 
     """
+    _compiled_target = staticmethod(lambda obj, store, field: None)
+
     def get_value(self):
         return self.get_method()(*self.args, **self.kwargs)
 
+    def compile(self, field):
+        # Method names are evaluated each time (see get_method)
+        if not callable(self.method_or_methodname):
+            return None
+        return super(Method, self).compile(field)
+
 class ModelMethod(BaseMethod):
     """ A method proxy that will look for the given method
         as an attribute on the Model.
     """
+    _compiled_target = staticmethod(lambda obj, store, field: obj.__class__)
+
     def get_value(self):
         obj = self.field.proxied_args['ModelArg']
         return self.get_method(obj)(*self.args, **self.kwargs)
@@ -245,6 +392,8 @@ class ObjectMethod(BaseMethod):
             >>> user.get_full_name()
 
     """
+    _compiled_target = staticmethod(lambda obj, store, field: obj)
+
     def get_value(self):
         obj = self.field.proxied_args['ObjectArg']
         return self.get_method(obj)(*self.args, **self.kwargs)
@@ -253,6 +402,8 @@ class StoreMethod(BaseMethod):
     """ A method proxy that will look for the given method
         as an attribute on the Store.
     """
+    _compiled_target = staticmethod(lambda obj, store, field: store)
+
     def get_value(self):
         obj = self.field.proxied_args['StoreArg']
         return self.get_method(obj)(*self.args, **self.kwargs)
@@ -264,6 +415,8 @@ class FieldMethod(BaseMethod):
         Notes:
             Field is the field on the Store, not the Model.
     """
+    _compiled_target = staticmethod(lambda obj, store, field: field)
+
     def get_value(self):
         obj = self.field.proxied_args['FieldArg']
         return self.get_method(obj)(*self.args, **self.kwargs)
@@ -286,6 +439,8 @@ class ValueMethod(BaseMethod):
             u'2009-10-02 12:32:12'
             >>>
     """
+    _compiled_target = staticmethod(_value_target)
+
     def get_value(self):
         obj = self.field.proxied_args['ObjectArg']
         val = utils.resolve_dotted_attribute(obj, self.field.model_field_name)
@@ -298,4 +453,5 @@ class ValueMethod(BaseMethod):
 ###
 # Pre-built custom Methods
 ###
-DojoDateMethod = ValueMethod('strftime', '%Y-%m-%dT%H:%M:%S')
+DOJO_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+DojoDateMethod = ValueMethod('strftime', DOJO_DATE_FORMAT)
@@ -1,10 +1,6 @@
 import sys, inspect
 
-from django import VERSION as django_version
-if django_version >= (1, 5, 0):
-    import json
-else:
-    from django.utils import simplejson as json
+from dojango.util import json_backend
 
 from exceptions import ServiceException
 
@@ -189,13 +185,13 @@ class JsonService(BaseService):
         else:
             response = self.get_smd(request.get_full_path())
 
-        return json.dumps(response)
+        return json_backend.dumps(response)
 
     def process_request(self, request):
         """ Handle the request
         """
         try:
-            data = json.loads(request.raw_post_data)
+            data = json_backend.loads(request.raw_post_data)
             id, method_name, params = data["id"], data["method"], data["params"]
 
         # Doing a blanket except here because God knows kind of crazy
@@ -1,11 +1,17 @@
-from django import VERSION as django_version
-if django_version >= (1, 5, 0):
-    import json
-else:
-    from django.utils import simplejson as json
+import re
+import threading
 
+from dojango.util import json_backend
+from django.core.exceptions import ValidationError
 from django.utils.encoding import smart_unicode
-from django.core.paginator import Paginator
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query import QuerySet, ValuesQuerySet, prefetch_related_objects
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from dojango.conf import settings
+from dojango.decorators import query_key
+from dojango.util.coalesce import coalesce, request_user_key
+from dojango.util.paging import paginate, get_count, get_count_strategy
 
 from utils import get_fields_and_servicemethods
 from exceptions import StoreException, ServiceException
@@ -30,12 +36,221 @@ class StoreMetaclass(type):
             setattr(field, '_store_attr_name', fieldname)
         attrs['fields'] = fields
 
+        # Compile the fields once (see BaseStore._serialize)
+        attrs['_serialization_plan'] = compile_plan(fields)
+
+        # The paths of the related objects the fields need (see BaseStore.prefetch_objects)
+        attrs['_related_paths'] = related_paths(fields)
+
         return super(StoreMetaclass, cls).__new__(cls, name, bases, attrs)
 
+# The labels (<appname>.<modelname>) of the models, see BaseStore.get_identifier
+_model_labels = {}
+
+def _model_label(model):
+    try:
+        return _model_labels[model]
+    except KeyError:
+        label = _model_labels[model] = smart_unicode(model._meta)
+        return label
+
+def compile_plan(fields):
+    """ Returns the serialization plan of the given fields (a dict of
+        StoreFields): the list of the tuples (store_field_name, field,
+        accessor), see StoreField.compile().
+    """
+    return [ (field.store_field_name, field, field.compile()) for field in fields.values() ]
+
+def related_paths(fields):
+    """ Returns the sorted list of the dotted paths of the given fields
+        (see StoreField.related_path) that may follow relations.
+    """
+    return sorted(set([ field.related_path for field in fields.values() if field.related_path ]))
+
+def _get_relation(model, name):
+    """ Returns the tuple (related model, multiple) of the relation of the
+        model that is accessed by the attribute name, or None if it isn't
+        a relation. multiple is True for ManyToManyFields and reverse
+        ForeignKeys.
+    """
+    try:
+        field, m, direct, m2m = model._meta.get_field_by_name(name)
+    except FieldDoesNotExist:
+        direct = False
+    if direct:
+        if field.rel is None:
+            return None
+        return field.rel.to, m2m
+    # Reverse relations are accessed by their accessor name (ie 'book_set')
+    for related in model._meta.get_all_related_objects():
+        if related.get_accessor_name() == name:
+            return related.model, not related.field.unique
+    for related in model._meta.get_all_related_many_to_many_objects():
+        if related.get_accessor_name() == name:
+            return related.model, True
+    return None
+
+# The lookups per model and related paths, see related_lookups
+_related_lookups = {}
+
+def related_lookups(model, paths):
+    """ Returns the tuple (select, prefetch) of the lists of the lookups of
+        the relations of the model on the given dotted paths, that can be
+        passed to QuerySet.select_related() (ForeignKeys and OneToOneFields)
+        and QuerySet.prefetch_related() (relations to many objects and
+        everything behind them).
+    """
+    key = (model, tuple(paths))
+    try:
+        return _related_lookups[key]
+    except KeyError:
+        pass
+    select, prefetch = [], []
+    for path in paths:
+        names = []
+        current = model
+        multiple = False
+        for name in path.split('.'):
+            relation = _get_relation(current, name)
+            if relation is None:
+                break
+            current, many = relation
+            names.append(name)
+            multiple = multiple or many
+            if not multiple:
+                lookup = '__'.join(names)
+                if lookup not in select:
+                    select.append(lookup)
+        if multiple:
+            lookup = '__'.join(names)
+            if lookup not in prefetch:
+                prefetch.append(lookup)
+    ret = _related_lookups[key] = (select, prefetch)
+    return ret
+
+def _is_deferred(queryset, name):
+    """ Returns True if the field name of the model of the queryset isn't
+        loaded (see QuerySet.defer() and QuerySet.only()).
+    """
+    names, defer = queryset.query.deferred_loading
+    if defer:
+        return name in names
+    # only(): the loaded fields (and the ones followed, ie 'author__name')
+    return bool(names) and name not in [ n.split('__')[0] for n in names ]
+
+def _get_lookup_field(model, lookup):
+    """ Returns the model field the lookup (ie 'author__name') refers to,
+        following ForeignKeys and OneToOneFields, or None if it doesn't
+        refer to a (single valued) model field.
+    """
+    names = lookup.split('__')
+    for i, name in enumerate(names):
+        if name == 'pk':
+            field = model._meta.pk
+        else:
+            try:
+                field, m, direct, m2m = model._meta.get_field_by_name(name)
+            except FieldDoesNotExist:
+                return None
+            if not direct or m2m:
+                return None
+        if i < len(names) - 1:
+            if field.rel is None:
+                return None
+            model = field.rel.to
+    return field
+
+def compile_pattern(value, ignore_case=False):
+    """ Returns the tuple (lookup type, value) of the lookup that matches
+        the value of a Dojo query, where '*' matches any characters and
+        '?' a single one ('\\' escapes them), or None if it matches
+        everything:
+
+            'Bil*'      ('startswith', u'Bil')
+            '*bo'       ('endswith', u'bo')
+            '*ilb*'     ('contains', u'ilb')
+            'B?lbo'     ('regex', u'^B.lbo$')
+            'Bilbo'     ('exact', u'Bilbo')
+
+        With ignore_case the case insensitive lookup types are returned.
+    """
+    # The literal strings and the wildcards
+    parts = []
+    literal = []
+    escaped = False
+    for c in value:
+        if escaped:
+            literal.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c in '*?':
+            if literal:
+                parts.append((False, u''.join(literal)))
+                literal = []
+            if not (c == '*' and parts and parts[-1] == (True, '*')):
+                parts.append((True, c))
+        else:
+            literal.append(c)
+    if literal or escaped:
+        parts.append((False, u''.join(literal) + (escaped and '\\' or '')))
+
+    wildcards = [text for wildcard, text in parts if wildcard]
+    literals = [text for wildcard, text in parts if not wildcard]
+    if not wildcards:
+        lookup_type, value = 'exact', u''.join(literals)
+    elif not literals and '?' not in wildcards:
+        return None
+    elif '?' not in wildcards and len(literals) == 1:
+        if parts[0][0] and parts[-1][0]:
+            lookup_type = 'contains'
+        elif parts[0][0]:
+            lookup_type = 'endswith'
+        else:
+            lookup_type = 'startswith'
+        value = literals[0]
+    else:
+        lookup_type = 'regex'
+    if lookup_type == 'regex':
+        regex = []
+        for wildcard, text in parts:
+            if wildcard:
+                regex.append(text == '*' and '.*' or '.')
+            else:
+                regex.append(re.escape(text))
+        value = u'^%s$' % u''.join(regex)
+    if ignore_case:
+        lookup_type = 'i' + lookup_type
+    return lookup_type, value
+
+class _Context(object):
+    """ The state of a call of a Store: the request, the serialized data,
+        the item that is serialized and the options that are overridden
+        for the call (see BaseStore._enter).
+
+        Each thread has its own stack of contexts, so a single Store
+        instance (i.e. in a URLConf) can serve many requests at once.
+    """
+    def __init__(self, request=None, data=None, options=None):
+        self.request = request
+        self.data = data
+        if self.data is None:
+            self.data = {}
+        self.item = None
+        self.options = options or {}
+        self.serializing = False
+
 class BaseStore(object):
     """ The base Store from which all Stores derive
+
+        The state of a call (self.request, self.data) is held by a context
+        per thread (see _Context), the store itself is just configured by
+        its options.
     """
 
+    # The compiled fields, set by the StoreMetaclass
+    _serialization_plan = []
+
     class Meta(object):
         """ Inner class to hold store options.
 
@@ -73,6 +288,9 @@ class BaseStore(object):
                     to be rendered (see TreeStore).
         """
 
+        # The contexts of the calls per thread
+        self._local = threading.local()
+
         # Instantiate the inner Meta class
         self._meta = self.Meta()
 
@@ -91,6 +309,10 @@ class BaseStore(object):
         elif not self.has_option('label'):
             self.set_option('label', 'label')
         
+        # Select or prefetch the related objects the fields need?
+        if not self.has_option('prefetch'):
+            self.set_option('prefetch', True)
+
         # Is this a nested store? (indicating that it should be rendered as array)
         self.is_nested = is_nested
 
@@ -121,8 +343,56 @@ class BaseStore(object):
         except StoreException:
             self.service = None
 
-        self.request = None # Placeholder for the Request object (if used)
-        self.data = self.is_nested and [] or {} # The serialized data in it's final form
+    def _get_contexts(self):
+        """ Returns the stack of the contexts of the current thread,
+            the first one is used outside of calls.
+        """
+        try:
+            return self._local.contexts
+        except AttributeError:
+            self._local.contexts = [_Context()]
+            return self._local.contexts
+
+    def _get_context(self):
+        return self._get_contexts()[-1]
+    _context = property(_get_context)
+
+    def _enter(self, request=None, data=None, options=None):
+        """ Starts a call of the store in the current thread.
+            Every _enter() has to be followed by an _exit().
+        """
+        context = _Context(request, data, options)
+        self._get_contexts().append(context)
+        return context
+
+    def _exit(self):
+        """ Ends the current call of the store.
+        """
+        self._get_contexts().pop()
+
+    def _get_request(self):
+        """ The Request object of the current call (if used)
+        """
+        return self._context.request
+    def _set_request(self, request):
+        self._context.request = request
+    request = property(_get_request, _set_request)
+
+    def _get_data(self):
+        """ The serialized data in it's final form
+        """
+        return self._context.data
+    def _set_data(self, data):
+        self._context.data = data
+    data = property(_get_data, _set_data)
+
+    def _get_item(self):
+        """ The current object in it's serialized state
+        """
+        return self._context.item
+    def _set_item(self, item):
+        self._context.item = item
+    _item = property(_get_item, _set_item)
 
     def has_option(self, option):
         """ True/False whether the given option is set in the store
@@ -137,6 +407,10 @@ class BaseStore(object):
         """ Returns the given store option.
             Raises a StoreException if the option isn't set.
         """
+        # The options overridden for the current call
+        options = self._context.options
+        if option in options:
+            return options[option]
         try:
             return getattr(self._meta, option)
         except AttributeError:
@@ -156,17 +430,19 @@ class BaseStore(object):
 
             Returns the serialized store as Json.
         """
-        self.request = request
-
-        if self.service:
-            self._merge_servicemethods()
-            if not self.is_nested:
-                self.data['SMD'] = self.service.get_smd( request.get_full_path() )
+        self._enter(request)
+        try:
+            if self.service:
+                self._merge_servicemethods()
+                if not self.is_nested:
+                    self.data['SMD'] = self.service.get_smd( request.get_full_path() )
 
-            if request.method == 'POST':
-                return self.service(request)
+                if request.method == 'POST':
+                    return self.service(request)
 
-        return self.to_json()
+            return self.to_json()
+        finally:
+            self._exit()
 
     def __str__(self):
         """ Renders the store as Json.
@@ -184,9 +460,13 @@ class BaseStore(object):
         """ Returns a (theoretically) unique key for a given
             object of the form: <appname>.<modelname>__<pk>
         """
+        pk = obj._get_pk_val()
+        if isinstance(pk, (int, long)):
+            # The common case, without formatting the model's name each time
+            return u'%s__%d' % (_model_label(obj.__class__), pk)
         return smart_unicode('%s__%s' % (
             obj._meta,
-            obj._get_pk_val(),
+            pk,
         ), strings_only=True)
 
     def get_label(self, obj):
@@ -199,6 +479,49 @@ class BaseStore(object):
         except AttributeError:
             return self.get_identifier(obj)
 
+    def prefetch_objects(self, objects):
+        """ Returns the objects with the related objects the fields need
+            (see StoreField.related_path) selected (ForeignKeys) or
+            prefetched (ManyToManyFields, reverse ForeignKeys), so they
+            aren't fetched by a query per object.
+
+            QuerySets that weren't evaluated yet get select_related() and
+            prefetch_related(), the related objects of a list of model
+            instances are prefetched at once.
+
+            Set the 'prefetch' option to False to turn this off.
+        """
+        if not self.get_option('prefetch'):
+            return objects
+
+        fields = self.get_option('fields')
+        if fields is self.fields:
+            paths = self._related_paths
+        else:
+            paths = related_paths(fields)
+        if not paths:
+            return objects
+
+        if isinstance(objects, QuerySet):
+            if isinstance(objects, ValuesQuerySet) or objects._result_cache is not None:
+                return objects
+            select, prefetch = related_lookups(objects.model, paths)
+            # Deferred ForeignKeys can't be followed by select_related()
+            select = [ lookup for lookup in select if not _is_deferred(objects, lookup.split('__')[0]) ]
+            if select and objects.query.select_related is not True:
+                objects = objects.select_related(*select)
+            prefetch = [ lookup for lookup in prefetch if lookup not in objects._prefetch_related_lookups ]
+            if prefetch:
+                objects = objects.prefetch_related(*prefetch)
+        elif isinstance(objects, list) and objects and hasattr(objects[0], '_meta'):
+            model = objects[0].__class__
+            for obj in objects:
+                if obj.__class__ is not model:
+                    return objects
+            select, prefetch = related_lookups(model, paths)
+            prefetch_related_objects(objects, select + prefetch)
+        return objects
+
     def _merge_servicemethods(self):
         """ Merges the declared service methods from multiple
             stores into a single store.  The store reference on each
@@ -226,18 +549,13 @@ class BaseStore(object):
         """
         for store in self.get_option('stores'):
 
-            # The other stores will (temporarily) take on this store's 'identifier' and
-            # 'label' settings
-            orig_identifier = store.get_option('identifier')
-            orig_label = store.get_option('label')
-            for attr in ('identifier', 'label'):
-                store.set_option(attr, self.get_option(attr))
-
-            self.data['items'] += store.to_python()['items']
-
-            # Reset the old values for label and identifier
-            store.set_option('identifier', orig_identifier)
-            store.set_option('label', orig_label)
+            # The other stores will take on this store's 'identifier' and
+            # 'label' settings (for this call only)
+            options = {
+                'identifier': self.get_option('identifier'),
+                'label': self.get_option('label'),
+            }
+            self.data['items'] += store._to_python(options=options)['items']
 
     def add_store(self, *stores):
         """ Add one or more stores to this store.
@@ -263,20 +581,40 @@ class BaseStore(object):
 
                 objects:
                     The list (or any iterable, ie QuerySet) of objects that will
-                    fill the store -- the previous 'objects' setting will be restored
-                    after serialization is finished.
+                    fill the store -- the 'objects' setting isn't changed, the
+                    objects are just used for this serialization.
         """
+        return self._to_python(objects)
 
-        if objects is not None:
-            # Save the previous objects setting
-            old_objects = self.get_option('objects')
-            self.set_option('objects', objects)
-            self._serialize()
-            self.set_option('objects', old_objects)
+    def _to_python(self, objects=None, options=None):
+        """ Serializes the store in a new context, that overrides the
+            given options.
+        """
+        parent = self._context
+
+        # A serialization within a serialization (i.e. by a field of this
+        # store) gets its own data, otherwise the data of the call is used
+        if parent.serializing:
+            data = None
         else:
+            data = parent.data
+        context = self._enter(parent.request, data, dict(parent.options, **(options or {})))
+        if objects is not None:
+            context.options['objects'] = objects
+        context.serializing = True
+        try:
+            objects = self.get_option('objects')
+            if isinstance(objects, QuerySet) and objects._result_cache is None:
+                # Every call iterates its own clone, the QuerySet of the
+                # options (ie Meta.objects) is shared by all calls and threads
+                objects = objects.all()
+            context.options['objects'] = self.prefetch_objects(objects)
             self._serialize()
-
-        return self.data
+        finally:
+            self._exit()
+        if not parent.serializing:
+            parent.data = context.data
+        return context.data
 
     def to_json(self, *args, **kwargs):
         """ Serialize the store as Json.
@@ -289,9 +627,10 @@ class BaseStore(object):
                     fill the store.
 
                 All other args and kwargs are passed to json.dumps
+                (see dojango.util.json_backend)
         """
         objects = kwargs.pop('objects', None)
-        return json.dumps( self.to_python(objects), *args, **kwargs )
+        return json_backend.dumps( self.to_python(objects), *args, **kwargs )
 
     def _start_serialization(self):
         """ Called when serialization of the store begins
@@ -329,17 +668,28 @@ class BaseStore(object):
     def _handle_field(self, obj, field):
         """ Handle the given field in the Store
         """
-        # Fill the proxied_args on the field (for get_value methods that use them)
-        field.proxied_args.update({
+        self._item[field.store_field_name] = self._get_field_value(obj, field)
+
+    def _get_field_value(self, obj, field):
+        """ Returns the value of the given field for the object
+            using its get_value method.
+        """
+        # Fill the proxied_args on the field (for get_value methods that use them),
+        # they are restored afterwards, in case the field is serialized reentrantly
+        previous = field.proxied_args
+        field.proxied_args = {
             'RequestArg': self.request,
             'ObjectArg': obj,
             'ModelArg': obj.__class__,
             'FieldArg': field,
             'StoreArg': self,
-        })
+        }
 
         # Get the value
-        self._item[field.store_field_name] = field.get_value()
+        try:
+            return field.get_value()
+        finally:
+            field.proxied_args = previous
 
     def _end_object(self, obj):
         """ Called when serializing an object ends.
@@ -359,16 +709,60 @@ class BaseStore(object):
         """ Serialize the defined objects and stores into it's final form
         """
         self._start_serialization()
-        for obj in self.get_option('objects'):
-            self._start_object(obj)
 
-            for field in self.get_option('fields').values():
-                self._handle_field(obj, field)
+        cls = self.__class__
+        if cls._start_object.im_func is BaseStore._start_object.im_func and \
+                cls._handle_field.im_func is BaseStore._handle_field.im_func and \
+                cls._end_object.im_func is BaseStore._end_object.im_func:
+            self._serialize_objects()
+        else:
+            # The overridden hooks are called for every object
+            for obj in self.get_option('objects'):
+                self._start_object(obj)
+
+                for field in self.get_option('fields').values():
+                    self._handle_field(obj, field)
+
+                self._end_object(obj)
 
-            self._end_object(obj)
         self._end_serialization()
         self._merge_stores()
 
+    def _serialize_objects(self):
+        """ Serializes the objects using the compiled fields (see
+            compile_plan). Same as calling _start_object, _handle_field
+            and _end_object, but the options are just looked up once.
+        """
+        fields = self.get_option('fields')
+        if fields is self.fields:
+            plan = self._serialization_plan
+        else:
+            plan = compile_plan(fields)
+
+        identifier = self.get_option('identifier')
+        get_identifier = self.get_identifier
+        label = self.get_option('label')
+        get_label = None
+        # Do we have a 'label' that isn't one of the declared fields?
+        if label and ( label not in fields.keys() ) and callable( getattr(self, 'get_label', None) ):
+            get_label = self.get_label
+
+        if self.is_nested:
+            items = self.data
+        else:
+            items = self.data['items']
+
+        for obj in self.get_option('objects'):
+            item = {identifier: get_identifier(obj)}
+            if get_label is not None:
+                item[label] = get_label(obj)
+            for name, field, accessor in plan:
+                if accessor is None:
+                    item[name] = self._get_field_value(obj, field)
+                else:
+                    item[name] = accessor(obj, self)
+            items.append(item)
+
 class Store(BaseStore):
     """ Just defines the __metaclass__
 
@@ -386,12 +780,34 @@ class ModelQueryStore(Store):
         that implements the necessary mechanics to handle server queries
         the the exported Json RPC 'fetch' method.  Soon it will support
         QueryReadStore itself.
+
+        The page (the 'count' objects from 'start') is fetched by a single
+        slice of the objects, numRows by a single count (see the
+        'count_strategy' option).
+
+        If the request contains a 'cursor' parameter (the 'cursor' of the
+        previous response or an empty string), the objects are paginated
+        by keyset (see dojango.util.paging), so the page that continues the
+        previous one is fetched without an offset.
+
+        With the 'coalesce' option (defaults to the DOJANGO_COALESCE_REQUESTS
+        setting), identical concurrent requests are answered by a single
+        query (see dojango.util.coalesce and get_coalesce_key). They get
+        copies of the same data dict, its items are shared.
+
+        The objects (a QuerySet) are filtered by the Dojo query (just by
+        the fields of the 'filter_fields' option) and sorted by the
+        database, using the model fields that the StoreFields correspond
+        to (see filter_objects and sort_objects).
     """
     def __init__(self, *args, **kwargs):
         """
         """
 
         objects_per_query = kwargs.pop('objects_per_query', None)
+        count_strategy = kwargs.pop('count_strategy', None)
+        coalesce = kwargs.pop('coalesce', None)
+        filter_fields = kwargs.pop('filter_fields', None)
 
         super(ModelQueryStore, self).__init__(*args, **kwargs)
 
@@ -400,37 +816,204 @@ class ModelQueryStore(Store):
         elif not self.has_option('objects_per_query'):
             self.set_option('objects_per_query', 25)
 
+        # How numRows is counted (see dojango.util.paging.get_count)
+        if count_strategy is not None:
+            self.set_option('count_strategy', count_strategy)
+        elif not self.has_option('count_strategy'):
+            self.set_option('count_strategy', get_count_strategy('model_query_store'))
+
+        if coalesce is not None:
+            self.set_option('coalesce', coalesce)
+        elif not self.has_option('coalesce'):
+            self.set_option('coalesce', settings.COALESCE_REQUESTS)
+
+        # The names of the store fields the objects can be filtered by
+        # (none by default, see filter_objects)
+        if filter_fields is not None:
+            self.set_option('filter_fields', filter_fields)
+        elif not self.has_option('filter_fields'):
+            self.set_option('filter_fields', ())
+
+    def _get_store_fields(self):
+        """ Returns the dict of the fields by their names in the store
+        """
+        return dict([ (field.store_field_name, field) for field in self.get_option('fields').values() ])
+
+    def get_lookup(self, model, field, sort=False):
+        """ Returns the lookup of the model field (ie 'author__name') that
+            the StoreField corresponds to, or None.
+
+            That is its sort_field or the model_field (dotted names are
+            followed) of a field that gets the value from the object.
+            When sorting, a sort_field isn't checked, otherwise the lookup
+            has to refer to a field of the model that isn't a relation.
+        """
+        lookup = field.sort_field
+        if lookup is not None and sort:
+            return lookup
+        if not isinstance(lookup, (str, unicode)) or _get_lookup_field(model, lookup) is None:
+            path = field.related_path
+            if path is None:
+                return None
+            lookup = path.replace('.', '__')
+        model_field = _get_lookup_field(model, lookup)
+        if model_field is None or (not sort and model_field.rel is not None):
+            return None
+        return lookup
+
     def filter_objects(self, request, objects, query):
         """ Overridable method used to filter the objects
             based on the query dict.
+
+            The query dict holds the Dojo query: the remaining GET params
+            (or the ones of a Json encoded 'query' param) and the Json
+            encoded 'queryOptions'. The values of the store fields listed
+            in the 'filter_fields' option are compiled into lookups (see
+            compile_pattern), so the database filters the objects:
+
+                class Meta:
+                    filter_fields = ('name',)
+
+                name=Bil*&queryOptions={"ignoreCase":true}
+
+            is filter(name__istartswith=u'Bil'). Other params are ignored,
+            objects that aren't a QuerySet aren't filtered. Without
+            'filter_fields' the objects aren't filtered at all, so clients
+            can't probe the values of fields that are just displayed.
         """
-        return objects
+        filter_fields = self.get_option('filter_fields')
+        if not filter_fields or not isinstance(objects, QuerySet):
+            return objects
+
+        query = dict(query)
+        try:
+            options = json_backend.loads(query.pop('queryOptions', None) or '{}')
+        except ValueError:
+            options = {}
+        if 'query' in query:
+            try:
+                query.update(json_backend.loads(query.pop('query')))
+            except (ValueError, TypeError):
+                pass
+        ignore_case = isinstance(options, dict) and bool(options.get('ignoreCase'))
+
+        fields = self._get_store_fields()
+        lookups = {}
+        for name, value in query.items():
+            field = fields.get(name)
+            if field is None or name not in filter_fields:
+                continue
+            lookup = self.get_lookup(objects.model, field)
+            if lookup is None:
+                continue
+            if value is None:
+                lookups[str(lookup + '__isnull')] = True
+                continue
+            if isinstance(value, (bool, int, long, float)):
+                lookups[str(lookup)] = value
+                continue
+            if not isinstance(value, basestring):
+                continue
+            compiled = compile_pattern(value, ignore_case)
+            if compiled is None:
+                continue
+            lookup_type, value = compiled
+            if lookup_type == 'exact':
+                model_field = _get_lookup_field(objects.model, lookup)
+                if model_field.get_internal_type() not in ('CharField', 'TextField'):
+                    try:
+                        value = model_field.to_python(value)
+                    except ValidationError:
+                        return objects.none()
+            lookups[str('%s__%s' % (lookup, lookup_type))] = value
+
+        if not lookups:
+            return objects
+        try:
+            return objects.filter(**lookups)
+        except (ValueError, TypeError, ValidationError):
+            # A value the field can't take
+            return objects.none()
 
     def sort_objects(self, request, objects, sort_attr, descending):
         """ Overridable method used to sort the objects based
             on the attribute given by sort_attr
+
+            sort_attr is a store field or a comma separated list of them,
+            the following ones prefixed by '-' when descending
+            (ie 'title,-price'). A QuerySet is ordered by the lookups of
+            the fields (see get_lookup), fields that can't be sorted are
+            ignored.
         """
+        if not sort_attr or not isinstance(objects, QuerySet):
+            return objects
+
+        fields = self._get_store_fields()
+        ordering = []
+        for i, name in enumerate(sort_attr.split(',')):
+            name = name.strip()
+            desc = name.startswith('-') or (i == 0 and descending)
+            field = fields.get(name.lstrip('-'))
+            if field is None or not field.can_sort:
+                continue
+            lookup = self.get_lookup(objects.model, field, sort=True)
+            if lookup is not None:
+                ordering.append((desc and '-' or '') + lookup)
+        if ordering:
+            objects = objects.order_by(*ordering)
         return objects
 
+    def get_coalesce_key(self, request):
+        """ Overridable method that returns the key used to coalesce
+            identical concurrent requests or None, if the request shouldn't
+            be coalesced. It has to contain everything the data depends on,
+            the default key consists of the store class, its options, the
+            query of the objects, the GET params and the user.
+        """
+        objects = self.get_option('objects')
+        if not isinstance(objects, QuerySet) or self.get_option('stores'):
+            return None
+        try:
+            sql, params = objects.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+        options = [self.get_option(option) for option in ('identifier', 'label', 'objects_per_query', 'count_strategy')]
+        return (self.__class__.__module__, self.__class__.__name__, options, objects.db, sql, params,
+                query_key(request), request_user_key(request))
+
     def __call__(self, request):
         """
         """
-        self.request = request
-
+        self._enter(request)
+        try:
+            if self.get_option('coalesce') and request.method in ('GET', 'HEAD'):
+                key = self.get_coalesce_key(request)
+                if key is not None:
+                    return dict(coalesce(key, lambda: self._get_page(request), settings.COALESCE_WINDOW))
+            return self._get_page(request)
+        finally:
+            self._exit()
+
+    def _get_page(self, request):
+        """ Returns the data of the page requested by the GET params.
+        """
         # We need the request.GET QueryDict to be mutable.
         query_dict = {}
         for k,v in request.GET.items():
             query_dict[k] = v
 
-        # dojox.data.QueryReadStore only handles sorting by a single field
+        cursor = query_dict.pop('cursor', None)
+
+        # dojox.data.QueryReadStore passes the sort fields comma separated
+        # (ie '-title,price'), the first one decides 'descending'
         sort_attr   = query_dict.pop('sort', None)
         descending  = False
         if sort_attr and sort_attr.startswith('-'):
             descending = True
             sort_attr = sort_attr.lstrip('-')
 
-        # Paginator is 1-indexed
-        start_index = int( query_dict.pop('start', 0) ) + 1
+        # The index of the first object of the page (0-indexed)
+        start = max(int( query_dict.pop('start', 0) ), 0)
 
         # Calculate the count taking objects_per_query into account
         objects_per_query = self.get_option('objects_per_query')
@@ -445,17 +1028,22 @@ class ModelQueryStore(Store):
 
         objects = self.filter_objects(request, self.get_option('objects'), query_dict)
         objects = self.sort_objects(request, objects, sort_attr, descending)
+        objects = self.prefetch_objects(objects)
 
-        paginator = Paginator(objects, count)
-
-        page_num = 1
-        for i in xrange(1, paginator.num_pages + 1):
-            if paginator.page(i).start_index() <= start_index <= paginator.page(i).end_index():
-                page_num = i
-                break
-
-        page = paginator.page(page_num)
-
-        data = self.to_python(objects=page.object_list)
-        data['numRows'] = paginator.count
+        use_cursor = cursor is not None and isinstance(objects, QuerySet)
+        if use_cursor:
+            # the cursor is valid for the same query only
+            state = (sorted(query_dict.items()), sort_attr, descending)
+            page_objects, cursor = paginate(objects, start, count, cursor, state)
+        else:
+            # A single query for the page, start doesn't have to be
+            # at the beginning of a page
+            page_objects = objects[start:start + count]
+
+        data = self.to_python(objects=page_objects)
+        data['numRows'], approximate = get_count(objects, self.get_option('count_strategy'))
+        if approximate:
+            data['numRowsApproximate'] = True
+        if use_cursor:
+            data['cursor'] = cursor
         return data
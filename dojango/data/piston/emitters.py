@@ -1,13 +1,11 @@
-from django import VERSION as django_version
-if django_version >= (1, 5, 0):
-    import json
-else:
-    from django.utils import simplejson as json
 from django.core.serializers.json import DateTimeAwareJSONEncoder
 from django.db.models.query import QuerySet
 from piston.emitters import Emitter
 from piston.validate_jsonp import is_valid_jsonp_callback_value
 
+from dojango.util import json_backend
+from dojango.util.paging import get_count, get_count_strategy
+
 
 class DojoDataEmitter(Emitter):
     """
@@ -56,14 +54,17 @@ class DojoDataEmitter(Emitter):
                 else:
                     dict_item.setdefault('_unicode', unicode_lookup_table[id])
 
+            num_rows, approximate = get_count(self.data, get_count_strategy('dojodata_emitter'))
             data = {
                 'identifier': 'id',
                 'items': data,
                 'label': '_unicode',
-                'numRows': self.data.count(),
+                'numRows': num_rows,
             }
+            if approximate:
+                data['numRowsApproximate'] = True
 
-        serialized_data = json.dumps(data, ensure_ascii=False,
+        serialized_data = json_backend.dumps(data, ensure_ascii=False,
             cls=DateTimeAwareJSONEncoder, indent=indent)
 
         if callback and is_valid_jsonp_callback_value(callback):
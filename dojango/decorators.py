@@ -1,12 +1,17 @@
-from django import VERSION as django_version
-if django_version >= (1, 5, 0):
-    import json
-else:
-    from django.utils import simplejson as json
-from django.http import HttpResponseNotAllowed, HttpResponseServerError
-
-from util import to_json_response
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import signals
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseServerError
+from django.utils.cache import has_vary_header
+
+from util import json_backend
+from util import to_json_response, not_modified_response
+from util import _etag_matches, _not_modified, _set_json_headers
 from util import to_dojo_data
+from util.coalesce import coalesce, request_user_key
+from dojango.conf import settings
 
 try:
     from functools import wraps
@@ -54,7 +59,7 @@ def add_request_getdict(func):
 def __getdict(self, key):
     ret = self.get(key)
     try:
-        ret = json.loads(ret)
+        ret = json_backend.loads(ret)
     except ValueError: # The value was not JSON encoded :-)
         raise Exception('"%s" was not JSON encoded as expected (%s).' % (key, str(ret)))
     return ret
@@ -74,6 +79,214 @@ def json_response(func):
         return __prepare_json_ret(request, ret)
     return wraps(func)(inner)
 
+def json_stream_response(func):
+    """
+    Works like the json_response decorator, but the returned data is encoded
+    while it is sent to the client (see dojango.util.json_encode_iter).
+    QuerySets within the returned data are walked using .iterator(), so the
+    memory usage stays flat no matter how many rows are returned:
+
+        @json_stream_response
+        def my_view(request):
+           return to_dojo_data(MyModel.objects.all())
+
+    Note: errors that happen while the data is encoded can't be turned into
+    an error response anymore, because the response was already started.
+    """
+    def inner(request, *args, **kwargs):
+        ret = func(request, *args, **kwargs)
+        return __prepare_json_ret(request, ret, stream=True)
+    return wraps(func)(inner)
+
+def json_response_etag(version=None, cache_control=None):
+    """
+    A json response decorator that supports conditional GET requests using an
+    ETag (see dojango.util.to_json_response). Unchanged responses are answered
+    with "304 Not Modified" then.
+
+    Without arguments the ETag is computed out of the response body:
+
+        @json_response_etag()
+        def my_view(request):
+           return to_dojo_data(MyModel.objects.all())
+
+    If the version of the returned data can be determined cheaply, pass a
+    function that returns it. It gets the same arguments as the view, which
+    isn't called at all, if the client already has the current version:
+
+        @json_response_etag(version=lambda request: MyModel.objects.aggregate(Max('modified'))['modified__max'])
+        def my_view(request):
+           ...
+
+    cache_control overwrites the DOJANGO_JSON_CACHE_CONTROL setting.
+    """
+    def decorator(func):
+        def inner(request, *args, **kwargs):
+            etag = True
+            if version is not None:
+                etag = version(request, *args, **kwargs)
+                ret = not_modified_response(request, etag, cache_control=cache_control)
+                if ret is not None:
+                    return ret
+            ret = func(request, *args, **kwargs)
+            return __prepare_json_ret(request, ret, etag=etag, cache_control=cache_control)
+        return wraps(func)(inner)
+    return decorator
+
+def cached_json_response(models=(), vary_on=(), timeout=None):
+    """
+    Works like the json_response decorator, but the encoded response is stored
+    in django's cache. Cache hits skip the view and the json encoding at all:
+
+        @cached_json_response(models=[Country, City], vary_on=['continent'], timeout=600)
+        def my_view(request):
+           continent = request.GET.get('continent')
+           return to_dojo_data(Country.objects.filter(continent=continent))
+
+    models:
+        The model classes the returned data depends on. Saving or deleting an
+        instance of one of them invalidates all cached responses of the view.
+    vary_on:
+        The GET parameters the returned data depends on. The view's arguments
+        and the user of the request (anonymous users share the responses) are
+        always part of the cache key, other GET parameters are ignored!
+    timeout:
+        The cache timeout in seconds (defaults to the timeout of the cache).
+
+    Just successful GET requests are cached. Views that depend on anything
+    else of the request (i.e. the session) mustn't use this decorator.
+    The body is stored together with its ETag, clients that already have it
+    get a "304 Not Modified" (see dojango.util.to_json_response).
+    """
+    for model in models:
+        for signal in (signals.post_save, signals.post_delete):
+            signal.connect(_invalidate_cached_json_responses, sender=model,
+                           dispatch_uid="dojango.cached_json_response.%s" % _model_label(model))
+
+    def decorator(func):
+        view_name = "%s.%s" % (func.__module__, func.__name__)
+        def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return __prepare_json_ret(request, func(request, *args, **kwargs))
+            key = "dojango.cached_json_response.%s" % hashlib.md5(repr((
+                view_name, args, sorted(kwargs.items()),
+                [(name, request.GET.getlist(name)) for name in vary_on],
+                request_user_key(request),
+                _model_generations(models),
+            ))).hexdigest()
+            cached = cache.get(key)
+            if cached is None:
+                ret = __prepare_json_ret(request, func(request, *args, **kwargs), etag=True)
+                if ret.status_code == 200:
+                    # just the encoded body, the headers are set per request
+                    cached = (ret.content, ret.status_code, ret['Content-Type'], ret['ETag'])
+                    if timeout is None:
+                        cache.set(key, cached)
+                    else:
+                        cache.set(key, cached, timeout)
+                return ret
+            content, status, content_type, tag = cached
+            if _etag_matches(request, tag):
+                return _not_modified(tag)
+            ret = HttpResponse(content, status=status, content_type=content_type)
+            return _set_json_headers(ret, tag)
+        return wraps(func)(inner)
+    return decorator
+
+def _model_label(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.object_name)
+
+def _generation_key(model):
+    return "dojango.cached_json_response.generation.%s" % _model_label(model)
+
+def _model_generations(models):
+    """
+    Returns the current generations of the given models, which are part of
+    the cache keys of cached_json_response. A missing generation (i.e. if it
+    was evicted from the cache) is started with the current time, so it never
+    matches an older one.
+    """
+    keys = [_generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, int(time.time() * 1000))
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+def _invalidate_cached_json_responses(sender, **kwargs):
+    key = _generation_key(sender)
+    try:
+        cache.incr(key)
+    except ValueError: # the generation isn't in the cache
+        cache.add(key, int(time.time() * 1000))
+
+def coalesce_requests(key=None, window=None):
+    """
+    Coalesces identical concurrent GET requests of a view (see
+    dojango.util.coalesce): the view is called once, the requests that arrive
+    while it is running wait for it and get a copy of its response.
+
+        @coalesce_requests(window=0.5)
+        @json_response
+        def my_view(request):
+           ...
+
+    key:
+        A function that gets the same arguments as the view and returns the
+        key of the request or None, if it shouldn't be coalesced. Defaults to
+        the view's arguments, the GET parameters and the user.
+    window:
+        The seconds a response is reused after it was created (defaults to
+        the DOJANGO_COALESCE_WINDOW setting).
+
+    Just enabled by the DOJANGO_COALESCE_REQUESTS setting. Streaming
+    responses and responses that set cookies or vary on the Cookie header
+    (i.e. because the view used the session) can't be shared, the views of
+    the other requests are called then.
+    """
+    def decorator(func):
+        view_name = "%s.%s" % (func.__module__, func.__name__)
+        def inner(request, *args, **kwargs):
+            if not settings.COALESCE_REQUESTS or request.method not in ('GET', 'HEAD'):
+                return func(request, *args, **kwargs)
+            if key is not None:
+                request_key = key(request, *args, **kwargs)
+            else:
+                request_key = (args, sorted(kwargs.items()), query_key(request), request_user_key(request))
+            if request_key is None:
+                return func(request, *args, **kwargs)
+            own = []
+            def call():
+                response = func(request, *args, **kwargs)
+                own.append(response)
+                if getattr(response, 'streaming', False) or response.cookies or \
+                        has_vary_header(response, 'Cookie'):
+                    return None
+                return response.content, response.status_code, response.items()
+            shared = coalesce((view_name, request_key), call,
+                              window is None and settings.COALESCE_WINDOW or window)
+            if own:
+                # the view was called for this request
+                return own[0]
+            if shared is None:
+                # the response of the first request can't be shared
+                return func(request, *args, **kwargs)
+            content, status, headers = shared
+            ret = HttpResponse(content, status=status)
+            for header, value in headers:
+                ret[header] = value
+            return ret
+        return wraps(func)(inner)
+    return decorator
+
+def query_key(request):
+    """
+    Returns the normalized GET parameters of the request, for the key of
+    coalesce_requests.
+    """
+    return sorted([(name, request.GET.getlist(name)) for name in request.GET])
+
 def jsonp_response_custom(callback_param_name):
     """
     A jsonp (JSON with Padding) response decorator, where you can define your own callbackParamName.
@@ -124,7 +337,8 @@ def json_iframe_response(func):
         return __prepare_json_ret(request, ret, use_iframe=True)
     return wraps(func)(inner)
 
-def __prepare_json_ret(request, ret, callback_param_name=None, use_iframe=False):
+def __prepare_json_ret(request, ret, callback_param_name=None, use_iframe=False, stream=False,
+                       etag=None, cache_control=None):
     if ret==False:
         ret = {'success':False}
     elif ret==None: # Sometimes there is no return.
@@ -141,7 +355,8 @@ def __prepare_json_ret(request, ret, callback_param_name=None, use_iframe=False)
     json_ret = ""
     try:
         # Sometimes the serialization fails, i.e. when there are too deeply nested objects or even classes inside
-        json_ret = to_json_response(ret, func_name, use_iframe)
+        json_ret = to_json_response(ret, func_name, use_iframe, stream,
+                                    request=request, etag=etag, cache_control=cache_control)
     except Exception, e:
         print '\n\n===============Exception=============\n\n'+str(e)+'\n\n' 
         print ret
@@ -0,0 +1,57 @@
+import time
+from optparse import make_option
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from dojango.util.search import get_search_backends
+
+class Command(BaseCommand):
+    '''Builds the indexes of the datagrid search backends, that are configured
+    in the DOJANGO_DATAGRID_SEARCH setting (see dojango/util/search.py):
+    
+       ./manage.py dojango_search_index
+    
+    To just build the indexes of some models, pass them as app.model:
+    
+       ./manage.py dojango_search_index shop.customer
+    
+    By default the indexes are built in the database the routers choose for
+    writing the model, use --database to pick another one.
+    '''
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=None,
+                    help='The database to build the indexes in (default: the one of the routers).'),
+    )
+    args = '[app.model ...]'
+    help = 'Builds the indexes of the datagrid search backends (DOJANGO_DATAGRID_SEARCH setting).'
+
+    def handle(self, *args, **options):
+        try:
+            backends = get_search_backends()
+        except ImproperlyConfigured, e:
+            raise CommandError(str(e))
+        names = [name.lower() for name in args]
+        for name in names:
+            if name not in [key for key, backend in backends]:
+                raise CommandError("There is no search backend configured for %s" % name)
+        for key, backend in backends:
+            if names and key not in names:
+                continue
+            if int(options.get('verbosity', 1)) > 0:
+                print "Building the search index of %s" % key
+            start = time.time()
+            using = options.get('database') or router.db_for_write(backend.model)
+            transaction.enter_transaction_management(using=using)
+            transaction.managed(True, using=using)
+            try:
+                backend.build(using)
+                transaction.commit(using=using)
+            except:
+                transaction.rollback(using=using)
+                raise
+            finally:
+                transaction.leave_transaction_management(using=using)
+            if int(options.get('verbosity', 1)) > 0:
+                print "Done in %.1f seconds" % (time.time() - start)
@@ -59,12 +59,18 @@ class DatagridNode(template.Node):
     id:                id of datagird, optional but useful to if planning on using dojo.connect to the grid.
     label:             dict of attribute:label for header. (other ways exist of setting these)
     query:             way to specify conditions for the table. i.e. to only display elements whose id>10: query={ 'id__gt':10 }
+    project_columns:   if True, the datagrid-list view just loads and returns the visible columns (and the primary key),
+                       attributes that aren't shown (i.e. used by formatters) aren't part of the rows then. Defaults to False.
     search:            list or tuple of fields to query against when searching
     show_search:       Display search field (default: True). If False, you'll create your custom search field and call do_{{id}}_search 
     nosort:            fields not to sort on
     formatter:         dict of attribute:js formatter function
     json_store_url:    URL for the ReadQueryStore 
     selection_mode:    dojo datagrid selectionMode
+    keyset:            use keyset pagination (see dojango.util.paging), so scrolling deep into the grid stays fast
+    aggregates:        dict of attribute:function (or list of functions) shown below the grid, computed over all
+                       rows of the query by the server (sum, avg, min, max or count). i.e. aggregates={'amount': ['sum', 'avg']}
+    aggregates_url:    URL of the aggregates (see dojango.views.datagrid_aggregates)
     """
     model = None
     app_name = None
@@ -143,6 +149,35 @@ class DatagridNode(template.Node):
             # add to header
             opts['headers'].append(ret)
               
+        # just the visible fields are fetched by the datagrid-list view
+        if self.model and opts.get('project_columns'):
+            opts['query']['dojango_fields'] = ",".join([h['attname'] for h in opts['headers'] if not h['attname'] in opts['query']['inclusions']])
+
+        # the aggregates are fetched from the datagrid-aggregates view, in the order of the columns
+        if opts.get('aggregates'):
+            if self.model and not opts.get('aggregates_url'):
+                try:
+                    opts['aggregates_url'] = reverse("dojango-datagrid-aggregates", args=(self.app_name, self.model_name))
+                except NoReverseMatch:
+                    raise TemplateSyntaxError, "Please enable the url 'dojango-datagrid-aggregates' in your urls.py or pass an 'aggregates_url' to the datagrid templatetag."
+            if not opts.get('aggregates_url'):
+                raise TemplateSyntaxError, "'aggregates_url' not defined. If you use your own 'json_store_url' you have to define where the aggregates are fetched."
+            if self.model:
+                attnames = [f.attname for f in self.model._meta.fields]
+                for field in opts['aggregates']:
+                    if field not in attnames:
+                        raise TemplateSyntaxError, "Just the fields of the model can be aggregated, not '%s'." % field
+            columns = [h['attname'] for h in opts['headers']]
+            aggregates = []
+            # (fields that aren't shown come last)
+            for field in sorted(opts['aggregates'], key=lambda f: (columns + [f]).index(f)):
+                functions = opts['aggregates'][field]
+                if isinstance(functions, basestring):
+                    functions = [functions]
+                aggregates.extend(["%s:%s" % (field, f) for f in functions])
+            opts['aggregates'] = ",".join(aggregates)
+            opts['aggregate_labels'] = dict([(h['attname'], unicode(h['label'])) for h in opts['headers']])
+
         # no sort fields
         if opts.has_key("nosort"): 
             opts['nosort'] = "".join(["||row==%s"%(opts['list_display'].index(r)+1) for r in opts['nosort']])
@@ -13,6 +13,8 @@ urlpatterns = patterns('dojango',
     url(r'^test/states/$', 'views.test_states'),
     # Note: define accessible objects in DOJANGO_DATAGRID_ACCESS setting
     url(r'^datagrid-list/(?P<app_name>.+)/(?P<model_name>.+)/$', 'views.datagrid_list', name="dojango-datagrid-list"),
+    url(r'^datagrid-export/(?P<app_name>.+)/(?P<model_name>.+)/(?P<format>csv|ndjson)/$', 'views.datagrid_export', name="dojango-datagrid-export"),
+    url(r'^datagrid-aggregates/(?P<app_name>.+)/(?P<model_name>.+)/$', 'views.datagrid_aggregates', name="dojango-datagrid-aggregates"),
 )
 
 if settings.DEBUG:
@@ -1,21 +1,32 @@
 import os
 import datetime
+import hashlib
+import inspect
 from decimal import Decimal
 
-from django import VERSION as django_version
-if django_version >= (1, 5, 0):
-    import json
-else:
-    from django.utils import simplejson as json
+try:
+    # the C accelerated string encoding that is used by json.dumps
+    from json.encoder import encode_basestring_ascii
+except ImportError:
+    from django.utils.simplejson.encoder import encode_basestring_ascii
 
 from dojango.conf import settings # using the app-specific settings
+from dojango.util import json_backend
 from django.core.serializers.json import DateTimeAwareJSONEncoder
 from django.db.models import Model
 from django.db.models import ImageField, FileField
+from django.db.models import signals
+from django.db.models.fields.subclassing import Creator
 from django.db.models.query import QuerySet
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
+try:
+    # streaming responses are available since django version 1.5
+    from django.http import StreamingHttpResponse
+except ImportError:
+    StreamingHttpResponse = None
 from django.template.loader import render_to_string
 from django.utils.functional import Promise
+from django.utils.http import parse_etags, quote_etag
 
 try:
     # we need it, if we want to serialize query- and model-objects
@@ -103,94 +114,506 @@ def debug(request):
     return context_extras
 
 
-def json_encode(data):
+# the json_encode handlers keyed by type (see register_encoder)
+_encoders = {}
+# cache of the resolved handler for each concrete class, filled by _get_encoder
+_encoder_cache = {}
+
+def register_encoder(type_, func):
     """
-    The main issues with django's default json serializer is that properties that
-    had been added to an object dynamically are being ignored (and it also has 
-    problems with some models).
+    Registers a function that is used by json_encode for all instances of
+    type_ (and of its subclasses, unless they have their own handler):
+
+        register_encoder(uuid.UUID, lambda u: str(u))
+
+    The function gets the object and has to return a value that json_encode
+    can handle (i.e. a string, number, list or dict). The returned value is
+    encoded again, so it may contain models, dates, decimals, ...
+    """
+    _encoders[type_] = lambda writer, data: writer.write_any(func(data))
+    _encoder_cache.clear()
+
+def _get_encoder(cls):
+    """
+    Returns the handler for the given class. The handler registered for the
+    nearest class in the MRO wins, the result is cached per class.
+    """
+    try:
+        return _encoder_cache[cls]
+    except KeyError:
+        handler = _write_fallback
+        for base in inspect.getmro(cls):
+            if base in _encoders:
+                handler = _encoders[base]
+                break
+        _encoder_cache[cls] = handler
+        return handler
+
+class _JsonWriter(object):
+    """
+    Writes the json representation of an object while traversing it, without
+    building a copy of the data first. The handlers registered in _encoders
+    are called with the writer and the object and write the json text using
+    writer.write().
+    The output is the same json.dumps(..., cls=DateTimeAwareJSONEncoder)
+    returns (the default separators and ensure_ascii).
+    If graph is given (see _ObjectGraph), the handlers of lists, dicts, models
+    and QuerySets pass the objects to graph.enter() and graph.leave().
+    """
+    def __init__(self, graph=None):
+        self.chunks = []
+        self.write = self.chunks.append
+        self.graph = graph
+
+    def write_any(self, data):
+        _get_encoder(data.__class__)(self, data)
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+class _ObjectGraph(object):
+    """
+    Keeps track of the containers (lists, dicts, models and QuerySets) that
+    are written by a _JsonWriter:
+
+        - a container that is reached again while it is written raises a
+          ValueError instead of recursing forever
+        - if memoize is True, the json of every written container is kept and
+          reused, when the same object (by identity) is written again
+        - containers nested deeper than max_depth are replaced by a reference
+          stub (see _write_reference)
+    """
+    def __init__(self, memoize=False, max_depth=None):
+        # id: object of the containers that are being written
+        self.markers = {}
+        # id: (object, json) of the written containers, the object is kept to
+        # prevent its id from being reused
+        self.memo = None
+        if memoize:
+            self.memo = {}
+        self.max_depth = max_depth
+        # the positions in writer.chunks where the open containers start
+        self.starts = []
+
+    def enter(self, writer, data):
+        """
+        Called before a container is written. Returns True, if the json of
+        the container was already written (a memoized or a reference stub).
+        """
+        key = id(data)
+        if self.memo is not None and key in self.memo:
+            writer.write(self.memo[key][1])
+            return True
+        if key in self.markers:
+            raise ValueError("Circular reference detected (%s object)" % data.__class__.__name__)
+        if self.max_depth is not None and len(self.starts) >= self.max_depth:
+            _write_reference(writer, data)
+            return True
+        self.markers[key] = data
+        self.starts.append(len(writer.chunks))
+        return False
+
+    def leave(self, writer, data):
+        """
+        Called after a container was written.
+        """
+        key = id(data)
+        del self.markers[key]
+        start = self.starts.pop()
+        if self.memo is not None:
+            text = "".join(writer.chunks[start:])
+            writer.chunks[start:] = [text]
+            self.memo[key] = (data, text)
+
+    def is_full(self):
+        """
+        Returns True, if the items of the next container would be replaced
+        by reference stubs.
+        """
+        return self.max_depth is not None and len(self.starts) + 1 >= self.max_depth
+
+def _write_reference(writer, data):
+    """
+    Writes the stub of an object, that is nested too deep: {"_reference": pk}
+    for models (as used by dojo.data) and null for everything else.
+    """
+    pk = getattr(data, 'pk', None)
+    if isinstance(data, Model) and pk is not None:
+        writer.write('{"_reference": ')
+        writer.write_any(pk)
+        writer.write('}')
+    else:
+        writer.write("null")
+
+def _ordered_items(data):
     """
+    Returns the items of a dictionary in the order of a freshly built dict.
+    Before dojango wrote json directly, each dict was copied before passing it
+    to json.dumps and the keys of the copy may be ordered differently.
+    """
+    return dict(data.items()).iteritems()
+
+def _json_key(key):
+    """
+    Converts a dictionary key the same way json.dumps does it.
+    """
+    if isinstance(key, basestring):
+        return key
+    elif key is True:
+        return "true"
+    elif key is False:
+        return "false"
+    elif key is None:
+        return "null"
+    elif isinstance(key, float):
+        return repr(key)
+    elif isinstance(key, (int, long)):
+        return str(key)
+    raise TypeError("key %r is not a string" % (key,))
+
+def _write_fallback(writer, data):
+    # everything else (i.e. tuples) is left to json.dumps
+    writer.write(json_backend.dumps(data, cls=DateTimeAwareJSONEncoder))
 
-    def _any(data):
-        ret = None
-        # Opps, we used to check if it is of type list, but that fails 
-        # i.e. in the case of django.newforms.utils.ErrorList, which extends
-        # the type "list". Oh man, that was a dumb mistake!
-        if isinstance(data, list):
-            ret = _list(data)
-        # Same as for lists above.
-        elif appengine and isinstance(data, appengine.ext.db.Query):
-            ret = _list(data)
-        elif isinstance(data, dict):
-            ret = _dict(data)
-        elif isinstance(data, Decimal):
-            # json.dumps() cant handle Decimal
-            ret = str(data)
-        elif isinstance(data, QuerySet):
-            # Actually its the same as a list ...
-            ret = _list(data)
-        elif isinstance(data, Model):
-            ret = _model(data)
-        elif appengine and isinstance(data, appengine.ext.db.Model):
-            ret = _googleModel(data)
-        elif ObjectId and isinstance(data, ObjectId):
-            ret = str(data)
-        # here we need to encode the string as unicode (otherwise we get utf-16 in the json-response)
-        elif isinstance(data, basestring):
-            ret = unicode(data)
-        # see http://code.djangoproject.com/ticket/5868
-        elif isinstance(data, Promise):
-            ret = force_unicode(data)
-        elif isinstance(data, datetime.datetime):
-            # For dojo.date.stamp we convert the dates to use 'T' as separator instead of space
-            # i.e. 2008-01-01T10:10:10 instead of 2008-01-01 10:10:10
-            ret = str(data).replace(' ', 'T')
-        elif isinstance(data, datetime.date):
-            ret = str(data)
-        elif isinstance(data, datetime.time):
-            ret = "T" + str(data)
+def _write_null(writer, data):
+    writer.write("null")
+
+def _write_bool(writer, data):
+    writer.write(data and "true" or "false")
+
+def _write_int(writer, data):
+    writer.write(str(data))
+
+def _write_float(writer, data):
+    if data != data:
+        writer.write("NaN")
+    elif data == _INFINITY:
+        writer.write("Infinity")
+    elif data == -_INFINITY:
+        writer.write("-Infinity")
+    else:
+        writer.write(repr(data))
+_INFINITY = float("inf")
+
+def _write_string(writer, data):
+    # here we need to encode the string as unicode (otherwise we get utf-16 in the json-response)
+    writer.write(encode_basestring_ascii(unicode(data)))
+
+def _write_str(writer, data):
+    writer.write(encode_basestring_ascii(str(data)))
+
+def _write_list(writer, data):
+    graph = writer.graph
+    if graph is not None and graph.enter(writer, data):
+        return
+    write = writer.write
+    write("[")
+    first = True
+    for v in data:
+        if first:
+            first = False
         else:
-            # always fallback to a string!
-            ret = data
-        return ret
-    
-    def _model(data):
-        ret = {}
-        # If we only have a model, we only want to encode the fields.
-        for f in data._meta.fields:
+            write(", ")
+        _get_encoder(v.__class__)(writer, v)
+    write("]")
+    if graph is not None:
+        graph.leave(writer, data)
+
+def _write_dict(writer, data):
+    graph = writer.graph
+    if graph is not None and graph.enter(writer, data):
+        return
+    write = writer.write
+    write("{")
+    first = True
+    for k, v in _ordered_items(data):
+        if first:
+            first = False
+        else:
+            write(", ")
+        write(encode_basestring_ascii(_json_key(k)))
+        write(": ")
+        _get_encoder(v.__class__)(writer, v)
+    write("}")
+    if graph is not None:
+        graph.leave(writer, data)
+
+# cache of the serialization plans per model class (see _get_model_plan)
+_model_plans = {}
+
+class _ModelPlan(object):
+    """
+    The serialization plan of a model class, that is built once and reused
+    for every instance (see _get_model_plan):
+
+        fields: dict of attname: (encoded key, is_file_field) of all concrete fields
+        attnames: the list of the field attnames
+        key_order: the attnames in the order they are written, if no properties
+            were added to the instance (see _ordered_items)
+        excluded: set of attribute names that must not be encoded as dynamically
+            added properties (all class level attributes, the field attnames,
+            _state and delete)
+        values_names: the field names to pass to QuerySet.values_list(), if the
+            instances can be written from the raw values (see _write_queryset),
+            otherwise None
+    """
+    def __init__(self, model_class):
+        self.fields = {}
+        self.attnames = []
+        for f in model_class._meta.fields:
             # special FileField handling (they can't be json serialized)
-            if isinstance(f, ImageField) or isinstance(f, FileField):
-                ret[f.attname] = unicode(getattr(data, f.attname))
-            else:
-                ret[f.attname] = _any(getattr(data, f.attname))
-        # And additionally encode arbitrary properties that had been added.
-        fields = dir(data.__class__) + ret.keys()
+            self.fields[f.attname] = (encode_basestring_ascii(f.attname) + ": ",
+                                      isinstance(f, (ImageField, FileField)))
+            self.attnames.append(f.attname)
+        self.key_order = list(dict.fromkeys(self.attnames))
+        self.excluded = set(dir(model_class))
+        self.excluded.update(self.attnames)
         # ignoring _state and delete properties
-        add_ons = [k for k in dir(data) if k not in fields and k not in ('delete', '_state',)]
+        self.excluded.update(('delete', '_state',))
+        self.values_names = None
+        # A custom __init__ may add properties to the instances and fields
+        # using django's SubfieldBase convert the raw values on assignment.
+        if model_class.__init__.im_func is Model.__init__.im_func and not [
+                f for f in model_class._meta.fields if _has_subfield_descriptor(model_class, f)]:
+            self.values_names = [f.name for f in model_class._meta.fields]
+
+def _has_subfield_descriptor(model_class, field):
+    for klass in inspect.getmro(model_class):
+        if isinstance(klass.__dict__.get(field.attname), Creator):
+            return True
+    return False
+
+def _get_model_plan(model_class):
+    plan = _model_plans.get(model_class)
+    if plan is None:
+        plan = _model_plans[model_class] = _ModelPlan(model_class)
+    return plan
+
+def _write_model(writer, data):
+    graph = writer.graph
+    if graph is not None and graph.enter(writer, data):
+        return
+    write = writer.write
+    plan = _get_model_plan(data.__class__)
+    fields = plan.fields
+    # Arbitrary properties that had been added are encoded additionally.
+    # Everything on class level is already known by the plan, so only
+    # the instance's own attributes need to be looked at.
+    add_ons = [k for k in data.__dict__ if k not in plan.excluded]
+    if add_ons:
+        keys = dict.fromkeys(plan.attnames)
         for k in add_ons:
-            ret[k] = _any(getattr(data, k))
-        return ret
-
-    def _googleModel(data):
-        ret = {}
-        ret['id'] = data.key().id()
-        for f in data.fields():
-            ret[f] = _any(getattr(data, f))
-        return ret
-
-    def _list(data):
-        ret = []
+            keys[k] = None
+    else:
+        keys = plan.key_order
+    write("{")
+    first = True
+    for k in keys:
+        if first:
+            first = False
+        else:
+            write(", ")
+        value = getattr(data, k)
+        if k in fields:
+            key, is_file = fields[k]
+            write(key)
+            if is_file:
+                write(encode_basestring_ascii(unicode(value)))
+                continue
+        else:
+            write(encode_basestring_ascii(k))
+            write(": ")
+        _get_encoder(value.__class__)(writer, value)
+    write("}")
+    if graph is not None:
+        graph.leave(writer, data)
+
+def _values_rows(data):
+    """
+    Returns the tuple (columns, rows) to write the rows of a QuerySet, that
+    wasn't evaluated yet, out of values_list() without creating the model
+    instances (see _write_values_row). This is only possible, if the instances
+    can't carry any additional properties, otherwise None is returned.
+    """
+    plan = _get_model_plan(data.model)
+    query = data.query
+    if (data._result_cache is not None or plan.values_names is None
+            # custom QuerySets (i.e. ValuesQuerySet) may yield other things than instances
+            or data.__class__.iterator.im_func is not QuerySet.iterator.im_func
+            # these would add properties to the instances
+            or query.select_related or query.extra or query.aggregates
+            or getattr(data, '_prefetch_related_lookups', None)
+            or query.deferred_loading[0]
+            or signals.post_init.has_listeners(data.model)):
+        return None
+    # the positions of the values in the rows in the order they are written
+    columns = [(plan.fields[k], plan.attnames.index(k)) for k in plan.key_order]
+    return columns, data.values_list(*plan.values_names).iterator()
+
+def _write_values_row(writer, columns, row):
+    write = writer.write
+    write("{")
+    first = True
+    for (key, is_file), i in columns:
+        if first:
+            first = False
+        else:
+            write(", ")
+        write(key)
+        value = row[i]
+        if is_file:
+            # the same as unicode() of a FieldFile
+            write(encode_basestring_ascii(unicode(value or '')))
+        else:
+            _get_encoder(value.__class__)(writer, value)
+    write("}")
+
+def _write_queryset(writer, data):
+    graph = writer.graph
+    if graph is not None and graph.is_full():
+        # the instances are needed for the reference stubs
+        values = None
+    else:
+        values = _values_rows(data)
+    if values is None:
+        _write_list(writer, data)
+        return
+    if graph is not None and graph.enter(writer, data):
+        return
+    columns, rows = values
+    write = writer.write
+    write("[")
+    first = True
+    for row in rows:
+        if first:
+            first = False
+        else:
+            write(", ")
+        _write_values_row(writer, columns, row)
+    write("]")
+    if graph is not None:
+        graph.leave(writer, data)
+
+def _write_google_model(writer, data):
+    ret = {}
+    ret['id'] = data.key().id()
+    for f in data.fields():
+        ret[f] = getattr(data, f)
+    _write_dict(writer, ret)
+
+def _write_datetime(writer, data):
+    # For dojo.date.stamp we convert the dates to use 'T' as separator instead of space
+    # i.e. 2008-01-01T10:10:10 instead of 2008-01-01 10:10:10
+    writer.write(encode_basestring_ascii(str(data).replace(' ', 'T')))
+
+def _write_time(writer, data):
+    writer.write(encode_basestring_ascii("T" + str(data)))
+
+def _write_promise(writer, data):
+    # see http://code.djangoproject.com/ticket/5868
+    writer.write(encode_basestring_ascii(force_unicode(data)))
+
+# The builtin handlers. Subclasses are resolved by their MRO, so i.e.
+# django.newforms.utils.ErrorList, which extends the type "list", is
+# handled like a list.
+for _types, _handler in (
+        ((type(None),), _write_null),
+        ((bool,), _write_bool),
+        ((int, long), _write_int),
+        ((float,), _write_float),
+        ((basestring,), _write_string),
+        ((list,), _write_list),
+        ((QuerySet,), _write_queryset),
+        ((dict,), _write_dict),
+        # json.dumps() cant handle Decimal
+        ((Decimal,), _write_str),
+        ((Model,), _write_model),
+        ((Promise,), _write_promise),
+        ((datetime.datetime,), _write_datetime),
+        ((datetime.date,), _write_str),
+        ((datetime.time,), _write_time),
+    ):
+    for _type in _types:
+        _encoders[_type] = _handler
+del _types, _handler, _type
+if appengine:
+    _encoders[appengine.ext.db.Query] = _write_list
+    _encoders[appengine.ext.db.Model] = _write_google_model
+if ObjectId:
+    _encoders[ObjectId] = _write_str
+
+def json_encode(data, memoize=False, max_depth=None):
+    """
+    The main issues with django's default json serializer is that properties that
+    had been added to an object dynamically are being ignored (and it also has 
+    problems with some models).
+    Additional types can be supported using register_encoder.
+
+    For object graphs, where the same objects are referenced many times (i.e.
+    a related model that was added as property to every row):
+        memoize=True encodes every list, dict, model and QuerySet just once
+        and reuses its json for each further occurrence of the same object.
+        max_depth limits the nesting of these containers. Deeper models are
+        replaced by {"_reference": pk}, other containers by null.
+    With either option a ValueError is raised for circular references.
+    """
+    graph = None
+    if memoize or max_depth is not None:
+        graph = _ObjectGraph(memoize, max_depth)
+    writer = _JsonWriter(graph)
+    writer.write_any(data)
+    return writer.getvalue()
+
+def json_encode_iter(data):
+    """
+    Works like json_encode, but returns a generator that yields the json string
+    in chunks. Lists and dicts are walked element by element and QuerySets are
+    iterated using .iterator(), so neither the whole result set nor the
+    complete json string have to be held in memory at once.
+    """
+    values = None
+    if isinstance(data, QuerySet):
+        values = _values_rows(data)
+    if isinstance(data, dict):
+        yield "{"
+        first = True
+        for k, v in _ordered_items(data):
+            if not first:
+                yield ", "
+            first = False
+            yield encode_basestring_ascii(_json_key(k)) + ": "
+            for chunk in json_encode_iter(v):
+                yield chunk
+        yield "}"
+    elif values is not None:
+        columns, rows = values
+        yield "["
+        first = True
+        for row in rows:
+            if not first:
+                yield ", "
+            first = False
+            writer = _JsonWriter()
+            _write_values_row(writer, columns, row)
+            yield writer.getvalue()
+        yield "]"
+    elif isinstance(data, (list, QuerySet)):
+        # don't fetch the rows a second time if the QuerySet was already evaluated,
+        # prefetch_related() needs all instances at once
+        if (isinstance(data, QuerySet) and data._result_cache is None
+                and not getattr(data, '_prefetch_related_lookups', None)):
+            data = data.iterator()
+        yield "["
+        first = True
         for v in data:
-            ret.append(_any(v))
-        return ret
-    
-    def _dict(data):
-        ret = {}
-        for k,v in data.items():
-            ret[k] = _any(v)
-        return ret
-    
-    ret = _any(data)
-    return json.dumps(ret, cls=DateTimeAwareJSONEncoder)
+            if not first:
+                yield ", "
+            first = False
+            for chunk in json_encode_iter(v):
+                yield chunk
+        yield "]"
+    else:
+        yield json_encode(data)
 
 def json_decode(json_string):
     """
@@ -198,14 +621,38 @@ def json_decode(json_string):
     Sometimes you want to convert a json-string to a python object.
     It throws a ValueError, if the JSON String is invalid.
     """
-    return json.loads(json_string)
-    
-def to_json_response(data, func_name=None, use_iframe=False):
+    return json_backend.loads(json_string)
+
+def to_json_response(data, func_name=None, use_iframe=False, stream=False,
+                     request=None, etag=None, cache_control=None):
     """
     This functions creates a http response object. It mainly set the right
     headers for you.
     If you pass a func_name to it, it'll surround the json data with a function name.
+    If stream is True, a StreamingHttpResponse is returned that encodes the data
+    while it is sent (see json_encode_iter). This keeps the memory usage flat,
+    even if huge QuerySets are returned. Streaming is not possible when using an
+    iframe or a django version < 1.5, in that case a normal response is returned.
+
+    Conditional GET requests are supported by passing an etag:
+        etag=True computes a strong ETag out of the response body.
+        Any other value is used as the version of the data (i.e. a timestamp
+        of the last modification) to create a weak ETag. The response can be
+        answered without encoding the data then.
+    If the If-None-Match header of the passed request matches the ETag, a
+    "304 Not Modified" response is returned. Instead of the no-cache headers
+    the Cache-Control header is set to cache_control (defaults to the
+    DOJANGO_JSON_CACHE_CONTROL setting).
     """
+    content_type = "application/json; charset=%s" % settings.DEFAULT_CHARSET
+    tag = None
+    if etag is not None and etag is not True:
+        tag = _weak_etag(etag, func_name, use_iframe)
+        if _etag_matches(request, tag):
+            return _not_modified(tag, cache_control)
+    if stream and StreamingHttpResponse and not use_iframe and etag is not True:
+        ret = StreamingHttpResponse(_json_stream(data, func_name), content_type=content_type)
+        return _set_json_headers(ret, tag, cache_control)
     data = json_encode(data)
     # as of dojo version 1.2.0, prepending {}&&\n is the most secure way!!!
     # for dojo version < 1.2.0 you have to set DOJANGO_DOJO_SECURE_JSON = False
@@ -215,17 +662,76 @@ def to_json_response(data, func_name=None, use_iframe=False):
     # don't wrap it into a function, if we use an iframe
     if func_name and not use_iframe:
         data = "%s(%s)" % (func_name, data)
-    mimetype = "application/json"
     if use_iframe:
-        mimetype = "text/html"
+        content_type = "text/html; charset=%s" % settings.DEFAULT_CHARSET
         data = render_to_string("dojango/json_iframe.html", {'json_data': data})
-    ret = HttpResponse(data, mimetype=mimetype+"; charset=%s" % settings.DEFAULT_CHARSET)
-    # The following are for IE especially
-    ret['Pragma'] = "no-cache"
-    ret['Cache-Control'] = "must-revalidate"
-    ret['If-Modified-Since'] = str(datetime.datetime.now())
+    if etag is True:
+        tag = quote_etag(hashlib.md5(force_unicode(data).encode('utf-8')).hexdigest())
+        if _etag_matches(request, tag):
+            return _not_modified(tag, cache_control)
+    ret = HttpResponse(data, mimetype=content_type)
+    return _set_json_headers(ret, tag, cache_control)
+
+def _json_stream(data, func_name=None):
+    """
+    Generator used by to_json_response for the content of a streaming response.
+    """
+    if settings.DOJO_SECURE_JSON:
+        yield "{}&&\n"
+    if func_name:
+        yield "%s(" % func_name
+    for chunk in json_encode_iter(data):
+        yield chunk
+    if func_name:
+        yield ")"
+
+def not_modified_response(request, version, func_name=None, use_iframe=False, cache_control=None):
+    """
+    Returns a "304 Not Modified" response, if the client already has the given
+    version of the data, otherwise None. It uses the same weak ETag as
+    to_json_response(..., etag=version), so the data doesn't need to be
+    fetched at all, if the client is up to date.
+    """
+    tag = _weak_etag(version, func_name, use_iframe)
+    if _etag_matches(request, tag):
+        return _not_modified(tag, cache_control)
+    return None
+
+def _weak_etag(version, func_name=None, use_iframe=False):
+    return 'W/%s' % quote_etag(hashlib.md5(force_unicode(
+        "%s:%s:%s" % (version, func_name, use_iframe)).encode('utf-8')).hexdigest())
+
+def _etag_matches(request, tag):
+    """
+    Returns True, if the If-None-Match header of a GET request matches the
+    given ETag (using the weak comparison).
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return False
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or parse_etags(tag)[0] in etags
+
+def _not_modified(tag, cache_control=None):
+    ret = HttpResponseNotModified()
+    ret['ETag'] = tag
+    ret['Cache-Control'] = cache_control or settings.JSON_CACHE_CONTROL
     return ret
 
+def _set_json_headers(response, tag=None, cache_control=None):
+    if tag:
+        # the client may cache the response and revalidate it using the ETag
+        response['ETag'] = tag
+        response['Cache-Control'] = cache_control or settings.JSON_CACHE_CONTROL
+        return response
+    # The following are for IE especially
+    response['Pragma'] = "no-cache"
+    response['Cache-Control'] = cache_control or "must-revalidate"
+    response['If-Modified-Since'] = str(datetime.datetime.now())
+    return response
+
 def to_dojo_data(items, identifier='id', num_rows=None):
     """Return the data as the dojo.data API defines.
     The dojo.data API expects the data like so:
@@ -0,0 +1,91 @@
+"""
+Coalescing of identical concurrent requests ("single flight").
+
+When many clients fire the same request at once (i.e. when a dashboard with
+grids is loaded), every one of them would query the database. With
+
+    result = coalesce(key, func, window)
+
+just the first caller of a key calls func(), the callers that arrive while
+it is running (in other threads of the same process) wait for it and get the
+same result. If func() raises an exception, it is raised for all of them.
+If window is given, the result is reused for that many seconds after it was
+computed as well.
+
+The key has to contain everything the result depends on (i.e. the user, if
+the access to the data depends on it), the calls are matched by its repr().
+It is used by the coalesce_requests decorator (see dojango.decorators) for
+datagrid_list and by the ModelQueryStore, both are enabled by the
+DOJANGO_COALESCE_REQUESTS setting.
+"""
+import sys
+import threading
+import time
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+_lock = threading.Lock()
+# the calls in progress per key
+_calls = {}
+# the recent results per key: (expires, result)
+_recent = {}
+
+def coalesce(key, func, window=0):
+    """
+    Returns the result of func(), sharing it with the concurrent calls of the
+    same key (and the calls within window seconds after it was computed).
+    """
+    key = repr(key)
+    _lock.acquire()
+    try:
+        if window and key in _recent:
+            expires, result = _recent[key]
+            if expires > time.time():
+                return result
+            del _recent[key]
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    finally:
+        _lock.release()
+
+    if not leader:
+        call.done.wait()
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
+
+    try:
+        call.result = func()
+    except:
+        call.exc_info = sys.exc_info()
+    _lock.acquire()
+    try:
+        del _calls[key]
+        if window and call.exc_info is None:
+            now = time.time()
+            # the expired results are dropped, so the dict doesn't grow
+            for k in [k for k, (expires, result) in _recent.items() if expires <= now]:
+                del _recent[k]
+            _recent[key] = (now + window, call.result)
+    finally:
+        _lock.release()
+    call.done.set()
+    if call.exc_info is not None:
+        raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+    return call.result
+
+def request_user_key(request):
+    """
+    Returns the part of a key that identifies the user of the request (the
+    primary key or None for anonymous users).
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated():
+        return None
+    return user.pk
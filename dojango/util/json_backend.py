@@ -0,0 +1,102 @@
+"""
+The json backend that is used for all dumps/loads calls of dojango.
+
+It is chosen with the DOJANGO_JSON_BACKEND setting:
+
+    'json'        the json module (its C accelerator is used automatically,
+                  django < 1.5 uses django.utils.simplejson), the default
+    'simplejson'  the simplejson package
+    'ujson'       the ujson package
+    'orjson'      the orjson package
+    'auto'        the fastest of the above that is installed
+
+If the chosen package is not installed, the json module is used instead.
+The faster backends write compact json and don't support every option of
+json.dumps. Calls they can't handle are passed to the json module.
+"""
+from django import VERSION as django_version
+if django_version >= (1, 5, 0):
+    import json
+else:
+    from django.utils import simplejson as json
+from django.core.exceptions import ImproperlyConfigured
+
+from dojango.conf import settings # using the app-specific settings
+
+def _json_backend():
+    return json.dumps, json.loads
+
+def _simplejson_backend():
+    import simplejson
+
+    def dumps(obj, **kwargs):
+        # the encoder classes of django extend the ones of the json module
+        if 'cls' in kwargs:
+            return json.dumps(obj, **kwargs)
+        return simplejson.dumps(obj, **kwargs)
+    return dumps, simplejson.loads
+
+def _ujson_backend():
+    import ujson
+
+    def dumps(obj, **kwargs):
+        # ujson doesn't know about custom encoder classes (they are i.e.
+        # needed for dates) and just supports some of the options
+        if [k for k in kwargs if k not in ('ensure_ascii', 'indent')]:
+            return json.dumps(obj, **kwargs)
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False, **kwargs)
+        except (TypeError, OverflowError):
+            return json.dumps(obj, **kwargs)
+    return dumps, ujson.loads
+
+def _orjson_backend():
+    import orjson
+
+    def dumps(obj, cls=None, default=None, indent=None, **kwargs):
+        # orjson always writes utf-8
+        kwargs.pop('ensure_ascii', None)
+        if kwargs or indent not in (None, 2):
+            return json.dumps(obj, cls=cls, default=default, indent=indent, **kwargs)
+        if cls is not None:
+            default = cls().default
+        # dates are passed to the default function, so they are written
+        # the way the json module would write them
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            return json.dumps(obj, cls=cls, default=default, indent=indent)
+    return dumps, orjson.loads
+
+BACKENDS = {
+    'json': _json_backend,
+    'simplejson': _simplejson_backend,
+    'ujson': _ujson_backend,
+    'orjson': _orjson_backend,
+}
+# the order used by the 'auto' setting
+FASTEST_BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+def get_backend(name):
+    """
+    Returns the tuple (dumps, loads) of the given backend. Falls back to
+    the json module, if the backend isn't installed.
+    """
+    if name == 'auto':
+        names = FASTEST_BACKENDS
+    elif name in BACKENDS:
+        names = (name,)
+    else:
+        raise ImproperlyConfigured("Unknown DOJANGO_JSON_BACKEND '%s', use one of: %s" % (
+            name, ", ".join(('auto',) + FASTEST_BACKENDS)))
+    for name in names:
+        try:
+            return BACKENDS[name]()
+        except ImportError:
+            pass
+    return _json_backend()
+
+dumps, loads = get_backend(settings.JSON_BACKEND)
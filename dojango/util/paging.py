@@ -0,0 +1,299 @@
+"""
+Keyset ("seek") pagination of QuerySets for the endpoints of the
+dojox.data.QueryReadStore (see dojango.views.datagrid_list and the
+ModelQueryStore).
+
+With OFFSET start LIMIT count every page gets slower, because the database
+has to step over all rows before it. A page that continues the previous one
+can be fetched after the sort key and the primary key of the last row of the
+previous page instead, which costs the same for every page. These keys are
+passed to the client as an opaque cursor, that is sent back with the next
+request:
+
+    objects, cursor = paginate(queryset, start, count, request.GET.get('cursor'))
+
+The cursor is just used, if start is the end of the page it was created for,
+random jumps are answered using the offset.
+
+The total number of rows (numRows) of these endpoints is counted by
+get_count, using one of the strategies of the DOJANGO_COUNT_STRATEGY setting:
+
+    exact: a COUNT(*) query for every request
+    cached: the count is cached for DOJANGO_COUNT_CACHE_TIMEOUT seconds, keyed
+        on the query (so each filter has its own count)
+    estimate: if the rows aren't filtered, the row count of the table is taken
+        from the statistics of the database (PostgreSQL, MySQL and SQLite after
+        ANALYZE), otherwise the count is cached
+
+The setting is either one of these strategies or a dict of the strategy per
+endpoint ('datagrid_list', 'model_query_store', 'dojodata_emitter' and
+'datagrid_aggregates'), i.e.:
+
+    DOJANGO_COUNT_STRATEGY = {'datagrid_list': 'estimate'}
+
+The column aggregates of the datagrid (see get_aggregates) are cached the
+same way, if the strategy of the 'datagrid_aggregates' endpoint is cached or
+estimate (they can't be estimated).
+"""
+import hashlib
+
+from django.core import signing
+from django.core.cache import cache
+from django.db import connections, transaction, DatabaseError
+from django.db.models import Q, Sum, Avg, Min, Max, Count
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from dojango.conf import settings
+
+CURSOR_SALT = 'dojango.util.paging'
+
+def keyset_ordering(queryset):
+    """
+    Returns the tuple (lookup, descending, field) of the ordering of the
+    queryset, if it can be paginated by keyset, otherwise None.
+    That is the case, if it is ordered by a single field (or its default
+    ordering), that is neither nullable nor a relation. Without any ordering
+    the primary key is used.
+    """
+    query = queryset.query
+    if query.extra_order_by:
+        return None
+    ordering = list(query.order_by)
+    if not ordering and query.default_ordering:
+        ordering = list(queryset.model._meta.ordering)
+    if not ordering:
+        ordering = ['pk']
+    if len(ordering) != 1 or not isinstance(ordering[0], basestring) or ordering[0] == '?':
+        return None
+    descending = ordering[0].startswith('-')
+    lookup = ordering[0].lstrip('-')
+    field = _get_field(queryset.model, lookup)
+    if field is None:
+        return None
+    return lookup, descending, field
+
+def _get_field(model, lookup):
+    """
+    Returns the field the lookup (i.e. "author__name") refers to or None, if
+    one of the fields on the way may be null or the field itself is a
+    relation (which would be ordered by the related model).
+    """
+    names = lookup.split('__')
+    for i, name in enumerate(names):
+        if name == 'pk':
+            field = model._meta.pk
+        else:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+        if field.null:
+            return None
+        if i < len(names) - 1:
+            if not field.rel:
+                return None
+            model = field.rel.to
+        elif field.rel and field is not model._meta.pk:
+            return None
+    return field
+
+def _get_value(obj, lookup, field):
+    names = lookup.split('__')
+    for name in names[:-1]:
+        obj = getattr(obj, name)
+    return _json_value(getattr(obj, field.attname))
+
+def _json_value(value):
+    # the string representation is used for dates, decimals, ...
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    return unicode(value)
+
+def _state_hash(lookup, descending, state):
+    return hashlib.md5(repr((lookup, descending, state))).hexdigest()
+
+def paginate(queryset, start, count, cursor=None, state=None):
+    """
+    Returns the tuple (objects, cursor) with the list of the count objects
+    beginning at start and the cursor of the next page.
+
+    If the passed cursor was created for the page that ends at start (and the
+    same state), the objects are fetched after the keys it holds. The state
+    should identify everything (i.e. the filters of the request) that changes
+    the rows of the queryset.
+
+    If the queryset can't be paginated by keyset (see keyset_ordering), the
+    offset is used and the returned cursor is None. Otherwise the queryset is
+    additionally ordered by its primary key.
+    """
+    ordering = keyset_ordering(queryset)
+    if ordering is None:
+        return list(queryset[start:start + count]), None
+    lookup, descending, field = ordering
+    sign = descending and '-' or ''
+    if field is queryset.model._meta.pk:
+        queryset = queryset.order_by(sign + lookup)
+    else:
+        queryset = queryset.order_by(sign + lookup, sign + 'pk')
+
+    state = _state_hash(lookup, descending, state)
+    position = None
+    if cursor:
+        try:
+            position = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            pass
+    if position and position[0] == start and position[1] == state:
+        value, pk = position[2:]
+        op = descending and '__lt' or '__gt'
+        if field is queryset.model._meta.pk:
+            # the primary key doesn't need a tie-breaker
+            page = queryset.filter(**{lookup + op: value})[:count]
+        else:
+            page = queryset.filter(Q(**{lookup + op: value}) | Q(**{lookup: value, 'pk' + op: pk}))[:count]
+    else:
+        page = queryset[start:start + count]
+
+    objects = list(page)
+    if not objects:
+        return objects, None
+    last = objects[-1]
+    cursor = signing.dumps([start + len(objects), state, _get_value(last, lookup, field), _json_value(last.pk)],
+                           salt=CURSOR_SALT)
+    return objects, cursor
+
+COUNT_STRATEGIES = ('exact', 'cached', 'estimate')
+# estimates below this number are replaced by the exact count, it is cheap
+# and the statistics of small tables are often outdated
+ESTIMATE_THRESHOLD = 1000
+
+def get_count_strategy(endpoint):
+    """
+    Returns the count strategy of the endpoint from the DOJANGO_COUNT_STRATEGY
+    setting.
+    """
+    strategy = settings.COUNT_STRATEGY
+    if isinstance(strategy, dict):
+        strategy = strategy.get(endpoint, 'exact')
+    return strategy
+
+def get_count(objects, strategy='exact'):
+    """
+    Returns the tuple (count, approximate) with the number of the objects
+    (a QuerySet or a list) counted using the given strategy (see above).
+    approximate is True, if the count was estimated or taken from the cache.
+    """
+    if strategy not in COUNT_STRATEGIES:
+        raise ValueError("Unknown count strategy '%s', use one of: %s" % (strategy, ", ".join(COUNT_STRATEGIES)))
+    if not hasattr(objects, 'query'):
+        return len(objects), False
+    if isinstance(objects, EmptyQuerySet):
+        # its query still is the one of the queryset it was created from
+        return 0, False
+    if strategy == 'estimate':
+        count = _estimate_count(objects)
+        if count is not None:
+            return count, True
+    if strategy in ('cached', 'estimate'):
+        try:
+            sql, params = objects.query.sql_with_params()
+        except EmptyResultSet:
+            return 0, False
+        key = _query_key("dojango.count", objects.db, sql, params)
+        count = cache.get(key)
+        if count is not None:
+            return count, True
+        count = objects.count()
+        cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+        return count, False
+    return objects.count(), False
+
+# the functions of get_aggregates
+AGGREGATES = {
+    'sum': Sum,
+    'avg': Avg,
+    'min': Min,
+    'max': Max,
+    'count': Count,
+}
+
+def get_aggregates(queryset, aggregates, strategy='exact'):
+    """
+    Returns the dict {field_name: {function: value}} of the aggregates (a list
+    of (field_name, function) tuples, i.e. [('amount', 'sum')], see AGGREGATES)
+    computed by a single aggregate() query over the queryset.
+    Unless the strategy is exact, the result is cached like a count.
+    """
+    if strategy not in COUNT_STRATEGIES:
+        raise ValueError("Unknown count strategy '%s', use one of: %s" % (strategy, ", ".join(COUNT_STRATEGIES)))
+    kwargs = {}
+    for name, function in aggregates:
+        if function not in AGGREGATES:
+            raise ValueError("Unknown aggregate '%s', use one of: %s" % (function, ", ".join(sorted(AGGREGATES))))
+        kwargs["%s__%s" % (name, function)] = AGGREGATES[function](name)
+    key = None
+    if strategy != 'exact' and not isinstance(queryset, EmptyQuerySet):
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            pass
+        else:
+            key = _query_key("dojango.aggregates", queryset.db, sql, params, sorted(kwargs))
+            values = cache.get(key)
+    if key is None or values is None:
+        values = queryset.aggregate(**kwargs)
+        if key is not None:
+            cache.set(key, values, settings.COUNT_CACHE_TIMEOUT)
+    ret = {}
+    for name, function in aggregates:
+        ret.setdefault(name, {})[function] = values["%s__%s" % (name, function)]
+    return ret
+
+def _query_key(prefix, *args):
+    return "%s.%s" % (prefix, hashlib.md5(repr(args)).hexdigest())
+
+def _estimate_count(queryset):
+    """
+    Returns the row count of the table of the queryset from the statistics of
+    the database or None, if the queryset is filtered, the database doesn't
+    provide it or the table is small.
+    """
+    query = queryset.query
+    if (query.where or getattr(query, 'having', None) or query.distinct
+            or query.low_mark or query.high_mark is not None
+            or query.model._meta.proxy or query.model._meta.parents):
+        return None
+    connection = connections[queryset.db]
+    table = query.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+        table = connection.ops.quote_name(table)
+    elif connection.vendor == 'mysql':
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+    elif connection.vendor == 'sqlite':
+        # just available after ANALYZE, the stat of each index starts with the row count
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    # a failing probe (i.e. a table that isn't on the search_path of PostgreSQL)
+    # is rolled back, so it doesn't abort the transaction of the request
+    sid = transaction.savepoint(using=queryset.db)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    except DatabaseError:
+        transaction.savepoint_rollback(sid, using=queryset.db)
+        return None
+    transaction.savepoint_commit(sid, using=queryset.db)
+    if row is None or row[0] is None:
+        return None
+    try:
+        count = int(float(str(row[0]).split()[0]))
+    except ValueError:
+        return None
+    if count < ESTIMATE_THRESHOLD:
+        return None
+    return count
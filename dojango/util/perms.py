@@ -1,20 +1,47 @@
 from django.conf import settings
 
+# the parsed DOJANGO_DATAGRID_ACCESS settings (see _parse_acl)
+_acl_cache = {}
+
+def _parse_acl(acl):
+    """
+    Returns the tuple (models, names) of the access list: the set of the
+    (app_name, model_name) tuples of the entries "app.model" and the set of
+    the other entries, that match an app name or a model name.
+    """
+    key = tuple(acl)
+    try:
+        return _acl_cache[key]
+    except KeyError:
+        models, names = set(), set()
+        for x in acl:
+            try:
+                if x.find(".")>0:
+                    app,model = x.split('.')
+                    models.add((app, model))
+                else:
+                    names.add(x)
+            except:
+                pass
+        _acl_cache[key] = models, names
+        return models, names
+
 def access_model(app_name, model_name, request=None, instance=None):
     """
     Return true to allow access to a given instance of app_name.model_name
     """
-    acl = getattr(settings, "DOJANGO_DATAGRID_ACCESS", [])
-    for x in acl:
-        try:
-            if x.find(".")>0:
-                app,model = x.split('.')
-                if app_name == app and model_name==model: return True
-            else:
-                if app_name == x or model_name==x: return True
-        except:
-            pass
-    return False
+    models, names = _parse_acl(getattr(settings, "DOJANGO_DATAGRID_ACCESS", []))
+    return (app_name, model_name) in models or app_name in names or model_name in names
+
+def _filter_model_queryset(app_name, model_name, request, queryset):
+    """
+    The batch version of access_model: returns the queryset of the instances
+    that may be accessed or None, if the model may not be accessed at all.
+    """
+    if access_model(app_name, model_name, request):
+        return queryset
+    return None
+access_model.filter_queryset = _filter_model_queryset
 
 def access_model_field(app_name, model_name, field_name, request=None, instance=None):
     """
@@ -23,4 +50,12 @@ def access_model_field(app_name, model_name, field_name, request=None, instance=
     """
     # in django version 1.2 a new attribute is on all models: _state of type ModelState
     # that field shouldn't be accessible
-    return not field_name in ('delete', '_state',)
\ No newline at end of file
+    return not field_name in ('delete', '_state',)
+
+def _filter_model_fields(app_name, model_name, field_names, request=None):
+    """
+    The batch version of access_model_field: returns the set of the field_names
+    that may be accessed on all instances of app_name.model_name.
+    """
+    return set(field_names) - set(('delete', '_state',))
+access_model_field.filter_fields = _filter_model_fields
@@ -0,0 +1,391 @@
+"""
+Full-text search backends for the search box of the datagrid (see
+dojango.views.datagrid_list).
+
+Without a backend the grid's search ORs an exact match of each of the
+search_fields together, which scans the whole table. A backend is configured
+per model with the DOJANGO_DATAGRID_SEARCH setting:
+
+    DOJANGO_DATAGRID_SEARCH = {
+        'shop.customer': {
+            'backend': 'dojango.util.search.PostgresSearchBackend',
+            'fields': ('name', 'email'),
+            # further options are passed to the backend, i.e.
+            'config': 'english',
+        },
+    }
+
+Available backends:
+
+    PostgresSearchBackend: matches a tsvector of the fields, that is
+        indexed by a GIN index (option 'config', the text search
+        configuration, defaults to 'simple')
+    SqliteSearchBackend: an FTS5 table that holds the fields (option
+        'table', defaults to dojango_search_<db_table>). The model needs an
+        integer primary key.
+    IndexSearchBackend: an inverted index that is held in memory by each
+        process and stored in the file given by the option 'path'. It is
+        reloaded when the file was changed.
+
+The indexes (and the tables of SqliteSearchBackend) are built or rebuilt with:
+
+    ./manage.py dojango_search_index [app.model ...]
+
+The index of the IndexSearchBackend and the FTS5 table aren't updated when
+objects are saved, so the command has to be run regularly. All words of the
+search have to match, the last one as prefix, so the grid can search while
+typing. The matches are ranked, but a sort of the grid wins.
+"""
+import bisect
+import os
+import re
+import cPickle as pickle
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.db.models import get_model
+from django.test.signals import setting_changed
+from django.utils.importlib import import_module
+
+from dojango.conf import settings
+from dojango.util import force_unicode
+
+# the name of the extra select that holds the rank of a match
+RANK_ALIAS = 'dojango_search_rank'
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    """
+    Returns the list of the lowercased words of the text.
+    """
+    return _word_re.findall(force_unicode(text).lower())
+
+class BaseSearchBackend(object):
+    """
+    The base class of the search backends. A backend gets the model, the
+    names of the fields that are searched and its options.
+    """
+    def __init__(self, model, fields, limit=500, **options):
+        self.model = model
+        self.fields = fields
+        self.limit = limit
+        self.options = options
+
+    def search(self, query, limit=None, using=None):
+        """
+        Returns the list of the primary keys of the (at most limit) objects
+        that match the query, the best matches first. None is returned, if the
+        query doesn't contain any words. using is the alias of the database
+        (by default the one the routers choose for reading the model).
+        """
+        raise NotImplementedError
+
+    def filter(self, queryset, query):
+        """
+        Returns the queryset restricted to the objects that match the query,
+        ordered by their rank (the annotation RANK_ALIAS).
+        """
+        pks = self.search(query, self.limit, queryset.db)
+        if pks is None:
+            return queryset
+        if not pks:
+            return queryset.filter(pk__in=pks)
+        # the position of a match in the list of search() is its rank
+        pk = self._qualified(connections[queryset.db], self.model._meta.pk.column)
+        rank = "CASE %s %s END" % (pk, " ".join(["WHEN %%s THEN %d" % i for i in range(len(pks))]))
+        return queryset.filter(pk__in=pks).extra(
+            select={RANK_ALIAS: rank},
+            select_params=pks,
+            order_by=[RANK_ALIAS])
+
+    def build(self, using=None):
+        """
+        Builds the index (see the dojango_search_index command) in the
+        database using (by default the one the routers choose for writing
+        the model).
+        """
+        pass
+
+    def _connection(self, using=None, write=False):
+        if using is None:
+            if write:
+                using = router.db_for_write(self.model)
+            else:
+                using = router.db_for_read(self.model)
+        return connections[using]
+
+    def _column(self, name):
+        return self.model._meta.get_field(name).column
+
+    def _qualified(self, connection, column):
+        qn = connection.ops.quote_name
+        return "%s.%s" % (qn(self.model._meta.db_table), qn(column))
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Searches a tsvector of the fields using PostgreSQL's full-text search.
+    build() creates the GIN index of the tsvector expression.
+    """
+    def __init__(self, model, fields, config='simple', **options):
+        super(PostgresSearchBackend, self).__init__(model, fields, **options)
+        self.config = config
+
+    def _document(self, connection):
+        columns = ["coalesce(%s::text, '')" % self._qualified(connection, self._column(f)) for f in self.fields]
+        return "to_tsvector('%s', %s)" % (self.config.replace("'", "''"), " || ' ' || ".join(columns))
+
+    def _tsquery(self, query):
+        words = tokenize(query)
+        if not words:
+            return None
+        # the last word is matched as prefix
+        return " & ".join(words[:-1] + [words[-1] + ":*"])
+
+    def search(self, query, limit=None, using=None):
+        tsquery = self._tsquery(query)
+        if tsquery is None:
+            return None
+        connection = self._connection(using)
+        qn = connection.ops.quote_name
+        document = self._document(connection)
+        sql = "SELECT %s FROM %s WHERE %s @@ to_tsquery(%%s, %%s) ORDER BY ts_rank(%s, to_tsquery(%%s, %%s)) DESC" % (
+            self._qualified(connection, self.model._meta.pk.column), qn(self.model._meta.db_table),
+            document, document)
+        params = [self.config, tsquery, self.config, tsquery]
+        if limit:
+            sql += " LIMIT %s" % int(limit)
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query):
+        tsquery = self._tsquery(query)
+        if tsquery is None:
+            return queryset
+        document = self._document(connections[queryset.db])
+        return queryset.extra(
+            select={RANK_ALIAS: "ts_rank(%s, to_tsquery(%%s, %%s))" % document},
+            select_params=(self.config, tsquery),
+            where=["%s @@ to_tsquery(%%s, %%s)" % document],
+            params=(self.config, tsquery),
+            order_by=['-' + RANK_ALIAS])
+
+    def build(self, using=None):
+        connection = self._connection(using, write=True)
+        qn = connection.ops.quote_name
+        name = "dojango_search_%s" % self.model._meta.db_table
+        cursor = connection.cursor()
+        cursor.execute("DROP INDEX IF EXISTS %s" % qn(name))
+        cursor.execute("CREATE INDEX %s ON %s USING gin((%s))" % (
+            qn(name), qn(self.model._meta.db_table), self._document(connection)))
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """
+    Searches an FTS5 table of SQLite, which contains the fields of each
+    object (the rowid is the primary key). build() (re)creates the table.
+    """
+    def __init__(self, model, fields, table=None, **options):
+        super(SqliteSearchBackend, self).__init__(model, fields, **options)
+        self.table = table or "dojango_search_%s" % model._meta.db_table
+
+    def _match(self, query):
+        words = tokenize(query)
+        if not words:
+            return None
+        # every word is quoted, the last one is matched as prefix
+        return " ".join(['"%s"' % w for w in words[:-1]] + ['"%s"*' % words[-1]])
+
+    def search(self, query, limit=None, using=None):
+        match = self._match(query)
+        if match is None:
+            return None
+        connection = self._connection(using)
+        qn = connection.ops.quote_name
+        sql = "SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY rank" % (qn(self.table), qn(self.table))
+        if limit:
+            sql += " LIMIT %s" % int(limit)
+        cursor = connection.cursor()
+        cursor.execute(sql, [match])
+        return [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query):
+        match = self._match(query)
+        if match is None:
+            return queryset
+        connection = connections[queryset.db]
+        qn = connection.ops.quote_name
+        pk = self._qualified(connection, self.model._meta.pk.column)
+        table = qn(self.table)
+        return queryset.extra(
+            select={RANK_ALIAS: "SELECT rank FROM %s WHERE %s MATCH %%s AND rowid = %s" % (table, table, pk)},
+            select_params=(match,),
+            where=["%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)" % (pk, table, table)],
+            params=(match,),
+            order_by=[RANK_ALIAS])
+
+    def build(self, using=None):
+        connection = self._connection(using, write=True)
+        qn = connection.ops.quote_name
+        columns = [self._column(f) for f in self.fields]
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS %s" % qn(self.table))
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s)" % (
+            qn(self.table), ", ".join([qn(c) for c in columns])))
+        sql = "INSERT INTO %s (rowid, %s) VALUES (%s)" % (
+            qn(self.table), ", ".join([qn(c) for c in columns]), ", ".join(["%s"] * (len(columns) + 1)))
+        rows = self.model._default_manager.using(connection.alias).values_list('pk', *self.fields).iterator()
+        batch = []
+        for row in rows:
+            batch.append([row[0]] + [value is not None and force_unicode(value) or u'' for value in row[1:]])
+            if len(batch) == 1000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+class IndexSearchBackend(BaseSearchBackend):
+    """
+    Searches an inverted index (word: primary keys), that is built by
+    build() and stored in the file given by path.
+    The objects that contain all words of the query are ranked by the
+    number of words that match exactly (the last one may be a prefix).
+    """
+    def __init__(self, model, fields, path=None, **options):
+        super(IndexSearchBackend, self).__init__(model, fields, **options)
+        if not path:
+            raise ImproperlyConfigured("The IndexSearchBackend of %s needs a 'path' to store the index" % model.__name__)
+        self.path = path
+        # the tuple (mtime, postings, sorted words) of the loaded index, that
+        # is replaced as a whole, as the backend is shared by all threads
+        self._index = (None, {}, [])
+
+    def _load(self):
+        """Returns the current index (see __init__), reloading it if the file was changed."""
+        index = self._index
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            # not built yet
+            return index
+        if mtime != index[0]:
+            f = open(self.path, 'rb')
+            try:
+                postings = pickle.load(f)
+            finally:
+                f.close()
+            index = (mtime, postings, sorted(postings))
+            self._index = index
+        return index
+
+    def _prefixed(self, words, prefix):
+        """Returns the words (sorted) that start with prefix."""
+        i = bisect.bisect_left(words, prefix)
+        ret = []
+        while i < len(words) and words[i].startswith(prefix):
+            ret.append(words[i])
+            i += 1
+        return ret
+
+    def search(self, query, limit=None, using=None):
+        # the index doesn't depend on the database
+        words = tokenize(query)
+        if not words:
+            return None
+        mtime, postings, indexed = self._load()
+        scores = None
+        for i, word in enumerate(words):
+            matches = {}
+            if i == len(words) - 1:
+                for prefixed in self._prefixed(indexed, word):
+                    for pk in postings.get(prefixed, ()):
+                        matches[pk] = max(matches.get(pk, 0), prefixed == word and 2 or 1)
+            else:
+                for pk in postings.get(word, ()):
+                    matches[pk] = 2
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict([(pk, score + matches[pk]) for pk, score in scores.iteritems() if pk in matches])
+            if not scores:
+                return []
+        ranked = sorted(scores, key=lambda pk: (-scores[pk], pk))
+        if limit:
+            ranked = ranked[:limit]
+        return ranked
+
+    def build(self, using=None):
+        postings = {}
+        using = using or router.db_for_read(self.model)
+        rows = self.model._default_manager.using(using).values_list('pk', *self.fields).iterator()
+        for row in rows:
+            pk = row[0]
+            for value in row[1:]:
+                if value is None:
+                    continue
+                for word in tokenize(value):
+                    pks = postings.setdefault(word, [])
+                    if not pks or pks[-1] != pk:
+                        pks.append(pk)
+        # the primary keys of each word are stored without duplicates
+        for word, pks in postings.iteritems():
+            postings[word] = tuple(sorted(set(pks)))
+        tmp_path = self.path + '.tmp'
+        f = open(tmp_path, 'wb')
+        try:
+            pickle.dump(postings, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
+
+def _get_config():
+    # the model names are case insensitive
+    return dict([(key.lower(), options) for key, options in settings.DATAGRID_SEARCH.items()])
+
+# the tuples (options, backend instance) per model (see get_search_backend)
+_backends = {}
+
+def _setting_changed(sender, setting, value, **kwargs):
+    # i.e. override_settings in tests
+    if setting == 'DOJANGO_DATAGRID_SEARCH':
+        settings.DATAGRID_SEARCH = value or {}
+        _backends.clear()
+setting_changed.connect(_setting_changed)
+
+def get_search_backend(model):
+    """
+    Returns the search backend that is configured for the model in the
+    DOJANGO_DATAGRID_SEARCH setting or None.
+    """
+    key = "%s.%s" % (model._meta.app_label, model._meta.object_name.lower())
+    options = _get_config().get(key)
+    # a backend is reused as long as its configuration doesn't change
+    if key in _backends and _backends[key][0] == options:
+        return _backends[key][1]
+    backend = None
+    if options is not None:
+        kwargs = dict(options)
+        path = kwargs.pop('backend', 'dojango.util.search.IndexSearchBackend')
+        module, name = path.rsplit('.', 1)
+        try:
+            backend_class = getattr(import_module(module), name)
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured("Can't load the search backend %s: %s" % (path, e))
+        backend = backend_class(model, kwargs.pop('fields'), **kwargs)
+    # just cached once it was built, a broken configuration raises every time
+    _backends[key] = (options is not None and dict(options) or None, backend)
+    return backend
+
+def get_search_backends():
+    """
+    Returns the list of the tuples ("app.model", backend) of all configured
+    search backends.
+    """
+    ret = []
+    for key in sorted(_get_config()):
+        app_label, model_name = key.split('.')
+        model = get_model(app_label, model_name)
+        if model is None:
+            raise ImproperlyConfigured("DOJANGO_DATAGRID_SEARCH: the model %s doesn't exist" % key)
+        ret.append((key, get_search_backend(model)))
+    return ret
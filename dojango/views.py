@@ -1,20 +1,52 @@
 # Create your views here.
+import csv
+import datetime
+
 from django.db.models import get_model
 from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query import QuerySet
 from django.shortcuts import render_to_response
 from django.conf import settings
+from django.http import Http404
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # django < 1.5, the iterator passed to a HttpResponse is streamed as well
+    from django.http import HttpResponse as StreamingHttpResponse
+from django.utils.encoding import force_unicode
 
 from dojango.util import to_dojo_data, json_encode
-from dojango.decorators import json_response
+from dojango.decorators import json_response, coalesce_requests, query_key
 from dojango.util import to_dojo_data
 from dojango.util.form import get_combobox_data
+from dojango.util.paging import paginate, get_count, get_count_strategy, get_aggregates, AGGREGATES
 from dojango.util.perms import access_model, access_model_field
+from dojango.util.search import get_search_backend, RANK_ALIAS
+from dojango.util.coalesce import request_user_key
 
+import heapq
 import operator
     
 # prof included for people using http://www.djangosnippets.org/snippets/186/
-AVAILABLE_OPTS =  ('search_fields','prof','inclusions','sort','search','count','order','start')
+# (the options that were added later are prefixed, so they don't shadow filters of model fields)
+AVAILABLE_OPTS =  ('search_fields','prof','inclusions','sort','search','count','order','start',
+                   'dojango_fields','dojango_cursor','dojango_aggregates')
+EXPORT_FORMATS = ('csv', 'ndjson')
+# the number of rows datagrid_export fetches at once, if it can't use iterator()
+EXPORT_CHUNK_SIZE = 500
+
+def _datagrid_key(request, app_name, model_name, access_model_callback=access_model, access_field_callback=access_model_field):
+    """
+    Returns the key of a datagrid_list request for coalesce_requests. The rows depend on the
+    user, unless the default access callbacks (which just check the settings) are used.
+    """
+    user = None
+    if access_model_callback is not access_model or access_field_callback is not access_model_field:
+        user = request_user_key(request)
+    return (app_name, model_name, access_model_callback, access_field_callback, query_key(request), user)
 
+@coalesce_requests(key=_datagrid_key)
 @json_response
 def datagrid_list(request, app_name, model_name, access_model_callback=access_model, access_field_callback=access_model_field):
     """
@@ -24,11 +56,18 @@ def datagrid_list(request, app_name, model_name, access_model_callback=access_mo
       'search_fields','inclusions','sort','search','count','order','start'
       
     search_fields: list of fields for model to equal the search, each OR'd together.
+        If a search backend is configured for the model (DOJANGO_DATAGRID_SEARCH setting),
+        it is used instead (see dojango.util.search).
     search: see search_fields
-    sort: sets order_by
+    sort: sets order_by, inclusions are sorted by their order_field (see get_order_field)
     count: sets limit
     start: sets offset
-    inclusions: list of functions in the model that will be called and result added to JSON
+    dojango_cursor: enables keyset pagination, pass the cursor of the previous response (or an
+        empty string for the first request) to fetch the page that follows it (see dojango.util.paging)
+    inclusions: list of functions in the model that will be called and result added to JSON,
+        the related objects they use are fetched with the rows, if they declare them (see get_columns)
+    dojango_fields: list of the fields that are shown, just these, the primary key and the
+        inclusions are added to JSON (see get_columns)
      
     any other GET param will be added to the filter on the model to determine what gets returned.  ie
     a GET param of id__gt=5 will result in the equivalent of model.objects.all().filter( id__gt=5 )
@@ -42,69 +81,455 @@ def datagrid_list(request, app_name, model_name, access_model_callback=access_mo
     
     The default callbacks will allow access to any model in added to the DOJANGO_DATAGRID_ACCESS
     in settings.py and any function/field that is not "delete"
+
+    With the DOJANGO_COALESCE_REQUESTS setting, identical concurrent requests share one response
+    (see dojango.util.coalesce). Other callbacks are expected to depend on the user only.
+
+    Instead of being called for every row, the callbacks can check the access once per request,
+    if they have the following attributes (like the default callbacks in dojango.util.perms):
+      access_model_callback.filter_queryset(app_name, model_name, request, queryset) returns the
+        queryset of the accessible rows (it may add filters) or None to deny access to the model
+      access_field_callback.filter_fields(app_name, model_name, field_names, request) returns
+        the set of the field_names that may be accessed on all rows
     """
     
     # get the model
     model = get_model(app_name,model_name)
-    
+    target, model_filter = _datagrid_target(request, app_name, model_name, model, access_model_callback)
+    num, approximate = get_count(target, get_count_strategy('datagrid_list'))
+
+    # until after all clauses added
+    target = _datagrid_search(request, model, target)
+
+    inclusions = [k for k in request.GET.get('inclusions', '').split(',') if k]
+    offset = int(request.GET['start'])
+    limit = offset + int(request.GET['count'])
+    target, columns, hidden = _datagrid_order(request, model, target, inclusions, limit)
+
+    # get only the limit number of models with a given offset
+    cursor = None
+    if request.GET.has_key('dojango_cursor') and isinstance(target, QuerySet):
+        # keyset pagination, the cursor is valid for the same query only
+        state = sorted([(k, v) for k, v in request.GET.items() if k not in ('start', 'count', 'dojango_cursor')])
+        target, cursor = paginate(target, offset, limit - offset, request.GET['dojango_cursor'], state)
+    else:
+        target=target[offset:limit]
+
+    # create a list of dict objects out of models for json conversion
+    to_row = _datagrid_row_converter(request, app_name, model_name, model, access_model_callback,
+                                     access_field_callback, model_filter, columns, inclusions, hidden)
+    complete = [to_row(data) for data in target]
+    ret = to_dojo_data(complete, identifier=model._meta.pk.name, num_rows=num)
+    if approximate:
+        # the grid just needs it to size the scrollbar
+        ret['numRowsApproximate'] = True
+    if request.GET.has_key('dojango_cursor'):
+        ret['cursor'] = cursor
+    return ret
+
+def datagrid_export(request, app_name, model_name, format='csv', access_model_callback=access_model, access_field_callback=access_model_field):
+    """
+    Streams all rows of a datagrid_list query as CSV or NDJSON (one json object per line),
+    depending on format. The GET params are the same as the ones of datagrid_list (filters,
+    search, sort, inclusions and fields), but start, count and cursor are ignored. The
+    callbacks are checked the same way as well.
+
+    The rows are read with QuerySet.iterator() and written as they are read, so the memory
+    doesn't grow with the number of exported rows. Two exceptions: if there are
+    prefetch_related lookups (many-valued inclusions), the rows are fetched in chunks of
+    EXPORT_CHUNK_SIZE, and a sort by an inclusion without an order_field (see get_order_field)
+    is done in python.
+
+    The columns of the CSV are the fields (in the order of the model), the other attributes
+    and the inclusions of the first row.
+    """
+    if format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format '%s'" % format)
+    model = get_model(app_name,model_name)
+    target, model_filter = _datagrid_target(request, app_name, model_name, model, access_model_callback)
+    target = _datagrid_search(request, model, target)
+    inclusions = [k for k in request.GET.get('inclusions', '').split(',') if k]
+    target, columns, hidden = _datagrid_order(request, model, target, inclusions, None)
+    to_row = _datagrid_row_converter(request, app_name, model_name, model, access_model_callback,
+                                     access_field_callback, model_filter, columns, inclusions, hidden)
+    rows = (to_row(data) for data in _iterate(target))
+    if format == 'csv':
+        lines = _csv_lines(rows, [f.attname for f in model._meta.fields], inclusions)
+        content_type = 'text/csv; charset=utf-8'
+    else:
+        lines = (json_encode(row) + "\n" for row in rows)
+        content_type = 'application/x-ndjson; charset=utf-8'
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (model_name, format)
+    return response
+
+@json_response
+def datagrid_aggregates(request, app_name, model_name, access_model_callback=access_model, access_field_callback=access_model_field):
+    """
+    Renders the aggregates of the columns of a datagrid_list query, i.e. for the footer of the
+    datagrid (see the aggregates option of the datagrid templatetag). They are computed over all
+    rows that match the filter and search GET params of datagrid_list (the other params are
+    ignored), using a single aggregate() query:
+
+      dojango_aggregates: comma separated list of field_name:function, the functions are sum, avg, min,
+          max and count, i.e. "amount:sum,amount:avg,created:max"
+
+    Returns {'aggregates': {'amount': {'sum': ..., 'avg': ...}, 'created': {'max': ...}}}, or
+    {'success': False, 'error': ...} if a field or function is unknown.
+    The result is cached like the count, if the count strategy of 'datagrid_aggregates' isn't
+    exact (see dojango.util.paging).
+
+    The fields have to be accessible (access_field_callback gets None as instance, if it doesn't
+    have a filter_fields function). If the access_model_callback doesn't have a filter_queryset
+    function, it is called for every row of the query!
+    """
+    model = get_model(app_name,model_name)
+    fields = {}
+    for f in model._meta.fields:
+        fields[f.name] = fields[f.attname] = f
+    # the grid uses the attnames, the query the names of the fields
+    aggregates, attnames = [], {}
+    for item in request.GET.get('dojango_aggregates', '').split(','):
+        if not item:
+            continue
+        name, function = (item.split(':', 1) + [None])[:2]
+        if name not in fields:
+            return {'success': False, 'error': "The model '%s.%s' doesn't have a field '%s'" % (app_name, model_name, name)}
+        if function not in AGGREGATES:
+            return {'success': False, 'error': "Unknown aggregate '%s' of the field '%s', use one of: %s" % (
+                function, name, ", ".join(sorted(AGGREGATES)))}
+        aggregates.append((fields[name].name, function))
+        attnames[fields[name].name] = name
+
+    target, model_filter = _datagrid_target(request, app_name, model_name, model, access_model_callback)
+    target = _datagrid_search(request, model, target)
+    if model_filter is None:
+        for data in target.iterator():
+            if not access_model_callback(app_name, model_name, request, data):
+                raise Exception, "You're not allowed to query the model '%s.%s' (add it to the array of the DOJANGO_DATAGRID_ACCESS setting)" % (model_name, app_name)
+
+    names = attnames.values()
+    field_filter = getattr(access_field_callback, 'filter_fields', None)
+    if field_filter is not None:
+        allowed = field_filter(app_name, model_name, names, request)
+    else:
+        allowed = [k for k in names if access_field_callback(app_name, model_name, k, request, None)]
+    for name in names:
+        if name not in allowed:
+            raise Exception, "You're not allowed to access the field '%s' of the model '%s.%s'" % (name, app_name, model_name)
+
+    values = get_aggregates(target, aggregates, get_count_strategy('datagrid_aggregates'))
+    return {'aggregates': dict([(attnames[name], value) for name, value in values.items()])}
+
+def _datagrid_target(request, app_name, model_name, model, access_model_callback):
+    """
+    Returns the tuple (queryset, model_filter) with the rows of the model, that are
+    accessible and match the filters of the GET params, and the filter_queryset function
+    of the access_model_callback (or None).
+    """
     # start with a very broad query set
     target = model.objects.all()
+
+    # a callback with a filter_queryset function checks the access once per request
+    model_filter = getattr(access_model_callback, 'filter_queryset', None)
+    if model_filter is not None:
+        target = model_filter(app_name, model_name, request, target)
+        if target is None:
+            raise Exception, "You're not allowed to query the model '%s.%s' (add it to the array of the DOJANGO_DATAGRID_ACCESS setting)" % (model_name, app_name)
     
     # modify query set based on the GET params, dont do the start/count splice
     # custom options passed from "query" param in datagrid
     for key in [ d for d in request.GET.keys() if not d in AVAILABLE_OPTS]:
         target = target.filter(**{str(key):request.GET[key]})
-    num = target.count()
+    return target, model_filter
 
-    # until after all clauses added
-    if request.GET.has_key('search') and request.GET.has_key('search_fields'):
+def _datagrid_search(request, model, target):
+    """
+    Returns the target restricted to the rows matching the search GET param.
+    """
+    search_backend = get_search_backend(model)
+    if request.GET.has_key('search') and search_backend is not None:
+        # a full-text search (see dojango.util.search)
+        target = search_backend.filter(target, request.GET['search'])
+    elif request.GET.has_key('search') and request.GET.has_key('search_fields'):
         ored = [models.Q(**{str(k).strip(): unicode(request.GET['search'])} ) for k in request.GET['search_fields'].split(",")]
         target = target.filter(reduce(operator.or_, ored))
+    return target
 
-    if request.GET.has_key('sort') and request.GET["sort"] not in request.GET["inclusions"] and request.GET["sort"][1:] not in request.GET["inclusions"]:
-		# if the sort field is in inclusions, it must be a function call.. 
-        target = target.order_by(request.GET['sort'])
-    else:
-		if request.GET.has_key('sort') and request.GET["sort"].startswith('-'):
-			target = sorted(target, lambda x,y: cmp(getattr(x,request.GET["sort"][1:])(),getattr(y,request.GET["sort"][1:])()));
-			target.reverse();
-		elif request.GET.has_key('sort'):
-			target =  sorted(target, lambda x,y: cmp(getattr(x,request.GET["sort"])(),getattr(y,request.GET["sort"])()));
-    
-    
-    # get only the limit number of models with a given offset
-    target=target[int(request.GET['start']):int(request.GET['start'])+int(request.GET['count'])]
-    # create a list of dict objects out of models for json conversion
-    complete = []
-    for data in target:
+def _datagrid_order(request, model, target, inclusions, limit):
+    """
+    Returns the tuple (target, columns, hidden): the target restricted to the shown fields
+    (see get_columns), with the related objects of the inclusions and sorted by the sort GET
+    param, the set of the columns (or None for all) and the set of the attribute names that
+    aren't part of the rows.
+    If the rows are sorted by an inclusion in python, target is the list of the first limit
+    rows (all rows, if limit is None).
+    """
+    sort = request.GET.get('sort')
+
+    # just the columns shown by the grid are rendered
+    columns, only = None, None
+    if request.GET.get('dojango_fields'):
+        columns, only = get_columns(model, request.GET['dojango_fields'].split(','), inclusions, sort)
+        if only is not None:
+            target = target.only(*only)
+
+    # the related objects of the inclusions, of the fields their methods depend on (and of
+    # the sort key) are fetched with the rows
+    paths = list(inclusions)
+    for name in inclusions:
+        paths.extend(getattr(getattr(model, name, None), 'depends_on', None) or ())
+    if sort and only is None:
+        # (deferred fields can't be followed by select_related)
+        paths.append(sort.lstrip('-'))
+    select_related, prefetch_related = get_related_lookups(model, paths)
+    if select_related:
+        target = target.select_related(*select_related)
+    if prefetch_related:
+        target = target.prefetch_related(*prefetch_related)
+
+    # the annotation used for sorting and the caches of the related objects aren't part of the rows
+    hidden = set(['_prefetched_objects_cache', RANK_ALIAS])
+    for lookup in select_related:
+        if '__' not in lookup:
+            hidden.add(model._meta.get_field(lookup).get_cache_name())
+    if sort and sort.lstrip('-') not in inclusions:
+        target = target.order_by(sort)
+    elif sort:
+        # if the sort field is in inclusions, it must be a function call..
+        name = sort.lstrip('-')
+        order_field = get_order_field(model, name)
+        if order_field is not None:
+            if not isinstance(order_field, basestring):
+                order_alias = "dojango_order_%s" % name
+                target = target.annotate(**{order_alias: order_field})
+                order_field = order_alias
+                hidden.add(order_alias)
+            target = target.order_by((sort.startswith('-') and "-" or "") + order_field)
+        else:
+            # just the rows up to the requested page are kept
+            target = _top_rows(target, name, sort.startswith('-'), limit)
+    return target, columns, hidden
+
+def _datagrid_row_converter(request, app_name, model_name, model, access_model_callback,
+                            access_field_callback, model_filter, columns, inclusions, hidden):
+    """
+    Returns a function that converts an object of the model to the dict of a row, containing
+    the accessible fields, attributes and inclusions.
+    """
+    # a callback with a filter_fields function checks each field name once per request
+    field_filter = getattr(access_field_callback, 'filter_fields', None)
+    checked = {}
+    def accessible(names, data):
+        if field_filter is None:
+            return [k for k in names if access_field_callback(app_name, model_name, k, request, data)]
+        unchecked = [k for k in names if k not in checked]
+        if unchecked:
+            allowed = field_filter(app_name, model_name, unchecked, request)
+            for k in unchecked:
+                checked[k] = k in allowed
+        return [k for k in names if checked[k]]
+
+    model_fields = [f for f in model._meta.fields if columns is None or f.attname in columns]
+    def to_row(data):
         # TODO: complete rewrite to use dojangos already existing serializer (or the dojango ModelStore)
-        if access_model_callback(app_name, model_name, request, data):   
+        if model_filter is not None or access_model_callback(app_name, model_name, request, data):
             ret = {}
-            for f in data._meta.fields:
-                if access_field_callback(app_name, model_name, f.attname, request, data):
+            allowed = set(accessible([f.attname for f in model_fields], data))
+            for f in model_fields:
+                if f.attname in allowed:
                     if isinstance(f, models.ImageField) or isinstance(f, models.FileField): # filefields can't be json serialized
                         ret[f.attname] = unicode(getattr(data, f.attname))
                     else:
                         ret[f.attname] = getattr(data, f.attname) #json_encode() this?
-            fields = dir(data.__class__) + ret.keys()
-            add_ons = [k for k in dir(data) if k not in fields and access_field_callback(app_name, model_name, k, request, data)]
-            for k in add_ons:
-                ret[k] = getattr(data, k)
-            if request.GET.has_key('inclusions'):
-                for k in request.GET['inclusions'].split(','):
-                    if k == "": continue
-                    if access_field_callback(app_name, model_name, k, request, data): 
-                        try:
-                            ret[k] = getattr(data,k)()
-                        except:
-                            try:
-                                ret[k] = eval("data.%s"%".".join(k.split("__")))
-                            except:
-                                ret[k] = getattr(data,k)
-            complete.append(ret)
+            if columns is None:
+                fields = dir(data.__class__) + ret.keys()
+                for k in accessible([k for k in dir(data) if k not in fields and k not in hidden], data):
+                    ret[k] = getattr(data, k)
+            for k in accessible(inclusions, data):
+                try:
+                    ret[k] = getattr(data,k)()
+                except:
+                    try:
+                        ret[k] = _get_path(data, k)
+                    except:
+                        ret[k] = getattr(data,k)
+            return ret
         else:
             raise Exception, "You're not allowed to query the model '%s.%s' (add it to the array of the DOJANGO_DATAGRID_ACCESS setting)" % (model_name, app_name)
-    return to_dojo_data(complete, identifier=model._meta.pk.name, num_rows=num)
+    return to_row
+
+def _iterate(target):
+    """
+    Iterates over the objects of target without caching them in the queryset. Querysets
+    with prefetch_related lookups (which iterator() doesn't do) are fetched in chunks,
+    using the keyset of the ordering where possible (see dojango.util.paging).
+    """
+    if not isinstance(target, QuerySet):
+        return iter(target)
+    if not getattr(target, '_prefetch_related_lookups', None):
+        return target.iterator()
+    def chunks():
+        start, cursor = 0, None
+        while True:
+            objects, cursor = paginate(target, start, EXPORT_CHUNK_SIZE, cursor)
+            for obj in objects:
+                yield obj
+            if len(objects) < EXPORT_CHUNK_SIZE:
+                break
+            start += len(objects)
+    return chunks()
+
+class _Echo(object):
+    """A file-like object that returns what is written to it (for csv.writer)."""
+    def write(self, value):
+        return value
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    return force_unicode(value).encode('utf-8')
+
+def _csv_lines(rows, field_names, inclusions):
+    """
+    Yields the lines of the CSV of the rows (dicts), starting with the header, that is
+    taken from the first row: the field_names, the other keys and the inclusions.
+    """
+    writer = csv.writer(_Echo())
+    header = None
+    for row in rows:
+        if header is None:
+            extra = sorted([k for k in row if k not in field_names and k not in inclusions])
+            header = [k for k in field_names if k in row] + extra + [k for k in inclusions if k in row]
+            yield writer.writerow(header)
+        yield writer.writerow([_csv_value(row.get(k)) for k in header])
+
+def get_order_field(model, name):
+    """
+    Returns what the rows of the datagrid_list are ordered by in the database,
+    when they are sorted by the inclusion (model method) name, or None if the
+    inclusion has to be sorted in python. It is declared on the method, either
+    as field lookup or as an expression that can be passed to annotate():
+
+        def author_name(self):
+            return self.author.name
+        author_name.order_field = 'author__name'
+
+        def tag_count(self):
+            return self.tags.count()
+        tag_count.order_field = models.Count('tags')
+
+    The admin_order_field of django's admin is used as well. Inclusions that
+    are paths of related fields (i.e. "customer__name") are ordered by that
+    path.
+    """
+    method = getattr(model, name, None)
+    if method is None and '__' in name:
+        return name
+    for attr in ('order_field', 'admin_order_field'):
+        order_field = getattr(method, attr, None)
+        if order_field is not None:
+            return order_field
+    return None
+
+def get_columns(model, names, inclusions=(), sort=None):
+    """
+    Returns the tuple (columns, only) for a datagrid_list, that just shows the
+    fields with the given names (or attnames):
+
+        columns: the set of the attnames of these fields and the primary key
+        only: the field names to pass to QuerySet.only() or None, if all
+            fields have to be loaded
+
+    The fields that are used by the inclusions (model methods) are loaded as
+    well, but they have to be declared on the methods. If an inclusion
+    doesn't declare them, all fields are loaded:
+
+        def full_name(self):
+            return "%s %s" % (self.first_name, self.last_name)
+        full_name.depends_on = ('first_name', 'last_name')
+
+    The declared fields may follow relations ("customer__name"), the related
+    objects are fetched together with the rows then (see get_related_lookups).
+    """
+    fields = {}
+    for f in model._meta.fields:
+        fields[f.name] = fields[f.attname] = f
+    columns = set([model._meta.pk.attname])
+    for name in names:
+        if name in fields:
+            columns.add(fields[name].attname)
+    only = [f.name for f in model._meta.fields if f.attname in columns]
+    for name in inclusions:
+        depends_on = getattr(getattr(model, name, None), 'depends_on', None)
+        if depends_on is None:
+            return columns, None
+        only.extend(depends_on)
+    # the sort key of the last row is read for the keyset pagination
+    if sort and sort.lstrip('-') in fields:
+        only.append(fields[sort.lstrip('-')].name)
+    return columns, only
+
+def get_related_lookups(model, paths):
+    """
+    Returns the tuple (select_related, prefetch_related) with the lists of
+    the lookups that fetch the related objects of the given paths
+    (i.e. "customer__name") together with the rows of the model: the foreign
+    keys along a path are joined by select_related, the first many-valued
+    relation is fetched by prefetch_related.
+    """
+    select_related, prefetch_related = [], []
+    for path in paths:
+        current = model
+        names = []
+        for name in path.split('__'):
+            try:
+                field, field_model, direct, m2m = current._meta.get_field_by_name(name)
+            except FieldDoesNotExist:
+                break
+            names.append(name)
+            lookup = '__'.join(names)
+            if direct and not m2m and field.rel:
+                if lookup not in select_related:
+                    select_related.append(lookup)
+                current = field.rel.to
+            else:
+                if (m2m or not direct) and lookup not in prefetch_related:
+                    prefetch_related.append(lookup)
+                break
+    return select_related, prefetch_related
+
+def _get_path(obj, path):
+    """
+    Returns the value of an inclusion like "customer__name" by following the
+    attributes (customer.name). If an object on the way is None, None is
+    returned.
+    """
+    for name in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+    return obj
+
+def _top_rows(target, name, descending, limit):
+    """
+    Returns the first limit objects of target sorted by the value of their
+    method name. Just these rows are kept (using a heap), instead of sorting
+    all of them (unless limit is None). The order is the same as sorting the whole list and
+    reversing it for a descending sort.
+    """
+    # the position of the row decides between equal values (_iterate keeps the
+    # prefetch_related lookups, which the methods may use)
+    rows = ((getattr(obj, name)(), i, obj) for i, obj in enumerate(_iterate(target)))
+    if limit is None:
+        rows = sorted(rows, reverse=descending)
+    elif descending:
+        rows = heapq.nlargest(limit, rows)
+    else:
+        rows = heapq.nsmallest(limit, rows)
+    return [obj for value, i, obj in rows]
 
 ###########
 #  Tests  #